@@ -0,0 +1,57 @@
+"""
+Compares the NumPy captcha classifier (resolve_captcha.captcha_classifier)
+with tesseract (resolve_captcha.resolve_captcha) on a saved corpus of labeled
+captchas (<label>.png files, see resolve_captcha.load_corpus).
+
+The corpus is split in a training and a test part; accuracy and the mean
+latency per image are reported on the test part.
+
+Usage:
+    python benchmarks/bench_captcha.py corpus [--test 0.2] [--model model.npz]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from resolve_captcha import resolve_captcha, captcha_classifier, load_corpus  # noqa: E402
+
+
+def evaluate(label, solve, images, labels):
+
+    start = time.perf_counter()
+    answers = [solve(x) for x in images]
+    elapsed = time.perf_counter() - start
+    accuracy = np.mean([x == y for x, y in zip(answers, labels)])
+    print(f'{label:<25s} accuracy {accuracy:7.1%}  {1000 * elapsed / len(images):9.3f} ms/image')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus')
+    parser.add_argument('--test', type=float, default=0.2)
+    parser.add_argument('--model', help='a trained model; the whole corpus is used as test set')
+    args = parser.parse_args()
+
+    images, labels = load_corpus(args.corpus)
+    order = np.random.default_rng(0).permutation(len(images))
+    images, labels = [images[i] for i in order], [labels[i] for i in order]
+
+    if args.model:
+        model = captcha_classifier.load(args.model)
+        test_images, test_labels = images, labels
+    else:
+        cut = int(len(images) * (1 - args.test))
+        model = captcha_classifier().fit(images[:cut], labels[:cut])
+        test_images, test_labels = images[cut:], labels[cut:]
+
+    print(f'{len(test_images)} test captchas, {len(model.labels)} templates')
+    evaluate('captcha_classifier', lambda x: model.solve(x)[0], test_images, test_labels)
+
+    try:
+        evaluate('tesseract (psm 7)', lambda x: resolve_captcha(x).text_from_captcha(), test_images, test_labels)
+    except OSError as e:
+        print(f'tesseract unavailable: {e}')
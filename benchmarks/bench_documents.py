@@ -0,0 +1,53 @@
+"""
+Compares the batch CPF/CNPJ kernel (document.check_documents) with the
+per-object classes (document.check_document and cpf_tools.CPFFormatter).
+
+Usage:
+    python benchmarks/bench_documents.py [n]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from document import check_document, check_documents  # noqa: E402
+from cpf_tools import CPFFormatter  # noqa: E402
+
+
+def random_documents(n, seed=0):
+
+    # Half CPF, half CNPJ, formatted and unformatted, valid or not
+    rng = np.random.default_rng(seed)
+    cpf = rng.integers(0, 10 ** 11, n // 2).astype(str)
+    cnpj = rng.integers(0, 10 ** 14, n - n // 2).astype(str)
+    cpf = np.char.zfill(cpf, 11)
+    cnpj = np.char.zfill(cnpj, 14)
+    cnpj[::2] = [f'{x[:2]}.{x[2:5]}.{x[5:8]}/{x[8:12]}-{x[12:]}' for x in cnpj[::2]]
+
+    return np.concatenate([cpf, cnpj])
+
+
+def timeit(label, func, n):
+
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<45s} {elapsed:8.3f} s  {n / elapsed:12,.0f} docs/s')
+    return elapsed
+
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sample = min(n, 50000)
+    docs = random_documents(n)
+
+    t0 = timeit(f'check_document, {sample} docs', lambda: [check_document(x) for x in docs[:sample]], sample)
+    t1 = timeit(f'CPFFormatter.validate, {sample // 2} CPF', lambda: [CPFFormatter(x).validate() for x in docs[:sample // 2]], sample // 2)
+    t2 = timeit(f'check_documents, {n} docs', lambda: check_documents(docs), n)
+    t3 = timeit(f'check_documents(formatted=False), {n} docs', lambda: check_documents(docs, formatted=False), n)
+
+    print(f'speedup over check_document: {(t0 / sample) / (t2 / n):.0f}x')
+    print(f'speedup over CPFFormatter: {(t1 / (sample // 2)) / (t2 / n):.0f}x')
+    print(f'speedup over CPFFormatter (validation only): {(t1 / (sample // 2)) / (t3 / n):.0f}x')
@@ -0,0 +1,75 @@
+"""
+Compares GeoPackage and GeoParquet snapshots of an embargo layer: write time,
+full reload, reload with column pruning and a bbox query.
+
+Usage:
+    python benchmarks/bench_snapshot.py [layer.gpkg]
+
+Without a layer, a synthetic national layer with 200k polygons is generated.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import geopandas as gpd
+from shapely import box
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from geoparquet import write_snapshot, read_snapshot  # noqa: E402
+
+
+def synthetic_layer(n=200000, seed=0):
+
+    rng = np.random.default_rng(seed)
+    ufs = np.array(['AC', 'AM', 'MT', 'PA', 'RO', 'RR', 'TO', 'MA', 'GO', 'BA'])
+    x = rng.uniform(-73, -35, n)
+    y = rng.uniform(-33, 5, n)
+    size = rng.uniform(0.001, 0.02, n)
+
+    return gpd.GeoDataFrame({'nome': np.char.add('Pessoa ', np.arange(n).astype(str)),
+                             'documento': rng.integers(10 ** 10, 10 ** 11, n).astype(str),
+                             'municipio': np.char.add('Municipio ', (np.arange(n) % 500).astype(str)),
+                             'uf': ufs[((x + 73) / 38 * len(ufs)).astype(int)]},
+                            geometry=box(x, y, x + size, y + size), crs='EPSG:4326')
+
+
+def timeit(label, func, repeat=3):
+
+    best = min(_run(func) for _ in range(repeat))
+    print(f'{label:<40s} {best:8.3f} s')
+    return best
+
+
+def _run(func):
+
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    layer = gpd.read_file(sys.argv[1]) if len(sys.argv) > 1 else synthetic_layer()
+    folder = tempfile.mkdtemp()
+    gpkg = os.path.join(folder, 'layer.gpkg')
+    parquet = os.path.join(folder, 'layer.parquet')
+    bbox = (-56.0, -12.0, -54.0, -10.0)
+
+    print(f'{len(layer)} features')
+    try:
+        timeit('write GeoPackage', lambda: layer.to_file(gpkg), repeat=1)
+        timeit('write GeoParquet (partitioned by uf)', lambda: write_snapshot(layer, parquet, partition_cols=['uf']), repeat=1)
+
+        t0 = timeit('read GeoPackage', lambda: gpd.read_file(gpkg))
+        t1 = timeit('read GeoParquet', lambda: read_snapshot(parquet))
+        timeit('read GeoPackage (2 columns)', lambda: gpd.read_file(gpkg, columns=['documento']))
+        timeit('read GeoParquet (2 columns)', lambda: read_snapshot(parquet, columns=['documento', 'geometry']))
+        timeit('read GeoPackage (bbox)', lambda: gpd.read_file(gpkg, bbox=bbox))
+        timeit('read GeoParquet (bbox)', lambda: read_snapshot(parquet, bbox=bbox))
+        timeit('read GeoParquet (uf = PA)', lambda: read_snapshot(parquet, filters=[('uf', '=', 'PA')]))
+
+        print(f'full reload speedup: {t0 / t1:.1f}x')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import tempfile
+import requests
+from os.path import exists, getmtime, join, expanduser
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+CACHE_DIR = os.environ.get('WEBSCRAP_CACHE_DIR', join(expanduser('~'), '.cache', 'webscrap'))
+
+
+class SnapshotCache:
+    """
+    On-disk cache for bulk datasets downloaded from public portals.
+
+    Each snapshot is stored as a single file in the cache directory, next to a
+    small JSON file with the ETag and Last-Modified headers returned by the
+    server. Snapshots younger than the TTL are served straight from disk; older
+    ones are revalidated with a conditional request, so an unchanged dataset
+    costs a 304 response instead of a full download. Files are written
+    atomically and guarded by a lock file, so several worker processes can share
+    the same directory.
+
+    Attributes
+    ----------
+    path : str
+        The directory where the snapshots are stored.
+    ttl : float
+        The number of seconds a snapshot is considered fresh.
+    """
+
+    def __init__(self, path: str = None, ttl: float = 86400) -> None:
+        self.path = CACHE_DIR if path is None else path
+        self.ttl = ttl
+        os.makedirs(self.path, exist_ok=True)
+
+    def file(self, key: str) -> str:
+        """Returns the path of the snapshot stored under key."""
+        return join(self.path, key)
+
+    def age(self, key: str) -> float:
+        """Returns the age of the snapshot in seconds (inf if it does not exist)."""
+        fname = self.file(key)
+        return time.time() - getmtime(fname) if exists(fname) else float('inf')
+
+    def isfresh(self, key: str, ttl: float = None) -> bool:
+        return self.age(key) < (self.ttl if ttl is None else ttl)
+
+    @contextmanager
+    def lock(self, key: str):
+        """Holds an exclusive lock on key across processes."""
+        with open(self.file(key) + '.lock', 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self, key: str) -> bytes:
+        with open(self.file(key), 'rb') as f:
+            return f.read()
+
+    def write(self, key: str, data: bytes, meta: dict = None) -> None:
+        """Writes the snapshot (and its metadata) atomically."""
+        self.__atomic_write(self.file(key), data)
+        if meta is not None:
+            self.__atomic_write(self.file(key) + '.meta', json.dumps(meta).encode('utf-8'))
+
+    def meta(self, key: str) -> dict:
+        fname = self.file(key) + '.meta'
+        if not exists(fname):
+            return {}
+        with open(fname, 'rb') as f:
+            return json.loads(f.read())
+
+    def fetch(self, key: str, url: str, session: requests.Session = None, method: str = 'get',
+              ttl: float = None, validate=None, **kwargs) -> bytes:
+        """
+        Returns the content of url, downloading it only when the cached copy is
+        stale and the server reports that it has changed.
+
+        Parameters
+        ----------
+            key : str
+                The file name used to store the snapshot.
+            url : str
+                The address of the dataset.
+            session : requests.Session
+                The session used for the request (a new one is created if None).
+            method : str
+                The HTTP method ('get' or 'post').
+            ttl : float
+                Overrides the TTL of the cache for this snapshot.
+            validate : callable
+                Called with a downloaded content before it is stored; if it
+                raises, the content is not cached and the exception propagates.
+            **kwargs
+                Extra arguments passed to the request (params, data, headers...).
+
+        Returns
+        -------
+        bytes
+            The content of the snapshot.
+        """
+        if self.isfresh(key, ttl):
+            return self.read(key)
+
+        with self.lock(key):
+            # Another process may have refreshed the snapshot while we waited
+            if self.isfresh(key, ttl):
+                return self.read(key)
+
+            cached = exists(self.file(key))
+            headers = dict(kwargs.pop('headers', {}) or {})
+            if cached:
+                meta = self.meta(key)
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta.get('etag')
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta.get('last_modified')
+
+            s = requests.Session() if session is None else session
+            try:
+                req = s.request(method, url, headers=headers, **kwargs)
+            except requests.RequestException as e:
+                if not cached:
+                    raise
+                print(f'Warning: Unable to revalidate {key} ({e}). Using the cached copy.')
+                return self.read(key)
+
+            if req.status_code == 304 and cached:
+                os.utime(self.file(key))
+                return self.read(key)
+
+            if not req.ok:
+                if not cached:
+                    req.raise_for_status()
+                print(f'Warning: the server returned the {str(req.status_code)} code error for {key}. Using the cached copy.')
+                return self.read(key)
+
+            meta = {'url': req.url,
+                    'etag': req.headers.get('ETag'),
+                    'last_modified': req.headers.get('Last-Modified'),
+                    'fetched_at': time.time()}
+            if validate is not None:
+                validate(req.content)
+            self.write(key, req.content, meta)
+
+            return req.content
+
+    def derive(self, key: str, source: str, build) -> bytes:
+        """
+        Returns the content stored under key, rebuilding it with build(data)
+        whenever the snapshot stored under source has been downloaded again.
+        A 304 revalidation keeps the derived content.
+        """
+        version = self.meta(source).get('fetched_at')
+        if exists(self.file(key)) and self.meta(key).get('source') == version:
+            return self.read(key)
+
+        with self.lock(key):
+            if exists(self.file(key)) and self.meta(key).get('source') == version:
+                return self.read(key)
+            data = build(self.read(source))
+            self.write(key, data, {'source': version})
+            return data
+
+    def __atomic_write(self, fname: str, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, fname)
+        except BaseException:
+            if exists(tmp):
+                os.remove(tmp)
+            raise
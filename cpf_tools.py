@@ -1,6 +1,20 @@
 from dataclasses import dataclass, field
 import re
 
+# The last digit before the two checker digits of the CPF number represent the state or group of states
+CPF_REGIONS = {
+    "0": "Rio Grande do Sul",
+    "1": "Distrito Federal, Goiás, Mato Grosso, Mato Grosso do Sul e Tocantins",
+    "2": "Amazonas, Pará, Roraima, Amapá, Acre e Rondônia",
+    "3": "Ceará, Maranhão e Piauí",
+    "4": "Paraíba, Pernambuco, Alagoas e Rio Grande do Norte",
+    "5": "Bahia e Sergipe",
+    "6": "Minas Gerais",
+    "7": "Rio de Janeiro e Espírito Santo",
+    "8": "São Paulo",
+    "9": "Paraná e Santa Catarina",
+}
+
 class CPFFormatter:
     """
     A class used to manipulate and validate CPF numbers.
@@ -93,33 +107,25 @@ class CPFFormatter:
         ndoc = self.digits
         return f"{ndoc[:3]}.{ndoc[3:6]}.{ndoc[6:9]}-{ndoc[9:]}"
 
-    def doc_from_uf(self) -> str:
+    def doc_from_uf(self, isvalid: bool = None) -> str:
         """
         Returns the state or group of states from where the CPF was issued.
 
+        Parameters
+        ----------
+            isvalid : bool
+                The result of validate(), when already known.
+
         Returns
         -------
         str
             The state or group of states.
         """
-        if not self.validate():
+        isvalid = self.validate() if isvalid is None else isvalid
+        if not isvalid:
             return "Invalid CPF"
 
-        # The last digit before the two checker digits of the CPF number represent the state or group of states
-        states = {
-            "0": "Rio Grande do Sul",
-            "1": "Distrito Federal, Goiás, Mato Grosso, Mato Grosso do Sul e Tocantins",
-            "2": "Amazonas, Pará, Roraima, Amapá, Acre e Rondônia",
-            "3": "Ceará, Maranhão e Piauí",
-            "4": "Paraíba, Pernambuco, Alagoas e Rio Grande do Norte",
-            "5": "Bahia e Sergipe",
-            "6": "Minas Gerais",
-            "7": "Rio de Janeiro e Espírito Santo",
-            "8": "São Paulo",
-            "9": "Paraná e Santa Catarina",
-        }
-
-        return states.get(self.digits[-3], "Unknown")
+        return CPF_REGIONS.get(self.digits[-3], "Unknown")
 
 
 from dataclasses import dataclass, field
@@ -162,4 +168,4 @@ class CPF:
         self.digits = data.digits
         self.formatted = data.formatter()
         self.isvalid = data.validate()
-        self.uf = data.doc_from_uf()
+        self.uf = data.doc_from_uf(self.isvalid)
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from document import parse_documents
+
+# CNPJ values carry this bit so that a CNPJ with leading zeros never collides
+# with a CPF holding the same integer value.
+CNPJ_FLAG = np.uint64(1 << 63)
+
+# Marks values that are not a CPF/CNPJ. It never appears in an index.
+MISSING = np.uint64(np.iinfo(np.uint64).max)
+
+# The place value of each column of a parsed (n, 14) digit matrix
+_POWERS = 10 ** np.arange(13, -1, -1, dtype=np.uint64)
+
+
+def encode_documents(documents) -> np.ndarray:
+    """
+    Encodes CPF/CNPJ numbers as uint64 values.
+
+    Documents are parsed by document.parse_documents (the same rules as
+    check_documents): 5 to 11 digits are read as a CPF and 12 to 14 digits as
+    a CNPJ (flagged with CNPJ_FLAG). Anything else is encoded as MISSING.
+
+    Parameters
+    ----------
+        documents : list | np.ndarray | pd.Series
+            Formatted or unformatted documents, as strings or integers.
+
+    Returns
+    -------
+    np.ndarray
+        The encoded documents (uint64).
+    """
+    if isinstance(documents, np.ndarray) and documents.dtype == np.uint64:
+        return documents
+
+    if not isinstance(documents, (pd.Series, np.ndarray)):
+        documents = pd.Series(list(documents), dtype=object)
+
+    return encode_matrix(*parse_documents(documents))
+
+
+def encode_matrix(matrix, iscpf, iscnpj) -> np.ndarray:
+
+    # Encodes the digit matrix returned by document.parse_documents
+    out = np.where(iscpf | iscnpj, matrix.astype(np.uint64) @ _POWERS, MISSING)
+    out[iscnpj] |= CNPJ_FLAG
+
+    return out
+
+
+class DocumentIndex:
+    """
+    A sorted array of encoded CPF/CNPJ numbers used for membership checks.
+
+    The array can be saved as a .npy file and loaded back memory-mapped, so
+    several processes share the same pages instead of holding their own copy.
+
+    Attributes
+    ----------
+    values : np.ndarray
+        The sorted, unique encoded documents (uint64).
+    """
+
+    def __init__(self, values: np.ndarray) -> None:
+        self.values = values
+
+    @classmethod
+    def from_documents(cls, documents) -> 'DocumentIndex':
+        values = encode_documents(documents)
+        return cls(np.unique(values[values != MISSING]))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'DocumentIndex':
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    def save(self, path: str) -> None:
+        np.save(path, np.ascontiguousarray(self.values))
+
+    def to_bytes(self) -> bytes:
+        buffer = BytesIO()
+        np.save(buffer, np.ascontiguousarray(self.values))
+        return buffer.getvalue()
+
+    def contains(self, documents) -> np.ndarray:
+        """
+        Returns a boolean array telling which documents are in the index.
+
+        Parameters
+        ----------
+            documents : list | np.ndarray | pd.Series
+                The documents to look up (raw or already encoded).
+
+        Returns
+        -------
+        np.ndarray
+            True where the document is in the index.
+        """
+        query = encode_documents(documents)
+        out = np.zeros(len(query), dtype=bool)
+        if len(self.values) == 0:
+            return out
+
+        # Sorted needles keep searchsorted walking the index in order; a query
+        # that is already sorted (e.g. by screen_documents) is not sorted again
+        if len(query) < 2 or (query[1:] >= query[:-1]).all():
+            pos = np.searchsorted(self.values, query)
+            pos[pos == len(self.values)] = 0
+            return (self.values[pos] == query) & (query != MISSING)
+
+        order = np.argsort(query, kind='stable')
+        needles = query[order]
+        pos = np.searchsorted(self.values, needles)
+        pos[pos == len(self.values)] = 0
+        out[order] = (self.values[pos] == needles) & (needles != MISSING)
+
+        return out
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, document) -> bool:
+        return bool(self.contains([document])[0])
@@ -1,5 +1,6 @@
 import re
 import numpy as np
+import pandas as pd
 
 
 class check_document:
@@ -75,3 +76,171 @@ class check_document:
 
     def __isdocument(self):
         return False if None in [self.document_type, self.isvalid, self.formatted_document] else True
+
+
+# Check digit weights, aligned with the 14 columns of a zero-padded document.
+# A CPF occupies the last 11 columns, so both types share the check digit
+# positions (columns 12 and 13).
+_CPF_W1 = np.array([0, 0, 0, 10, 9, 8, 7, 6, 5, 4, 3, 2, 0, 0])
+_CPF_W2 = np.array([0, 0, 0, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 0])
+_CNPJ_W1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2, 0, 0])
+_CNPJ_W2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2, 0])
+
+
+def _check_digit(matrix, weights):
+
+    dv = (10 * (matrix @ weights)) % 11
+    dv[dv == 10] = 0
+    return dv
+
+
+def format_matrix(matrix, iscpf):
+
+    # Builds the formatted strings as a byte matrix and decodes them at once
+    out = np.zeros((len(matrix), 18), dtype=np.uint8)
+    chars = matrix + ord('0')
+
+    cpf = chars[iscpf][:, 3:]
+    fmt = np.zeros((len(cpf), 18), dtype=np.uint8)
+    fmt[:, [0, 1, 2, 4, 5, 6, 8, 9, 10, 12, 13]] = cpf
+    fmt[:, [3, 7]] = ord('.')
+    fmt[:, 11] = ord('-')
+    out[iscpf] = fmt
+
+    cnpj = chars[~iscpf]
+    fmt = np.zeros((len(cnpj), 18), dtype=np.uint8)
+    fmt[:, [0, 1, 3, 4, 5, 7, 8, 9, 11, 12, 13, 14, 16, 17]] = cnpj
+    fmt[:, [2, 6]] = ord('.')
+    fmt[:, 10] = ord('/')
+    fmt[:, 15] = ord('-')
+    out[~iscpf] = fmt
+
+    return out.view('S18').ravel().astype(str)
+
+
+def _digit_matrix(documents, max_patterns=256):
+
+    # Returns the digits of every document right-aligned in a (n, 14) matrix and
+    # the number of digits found in each one. Rows are grouped by the positions
+    # of their digits (a column usually holds only a few layouts, such as
+    # '00000000000' and '000.000.000-00'), so each group is copied with plain
+    # column indexing. Too many layouts fall back to a per-digit scatter.
+    try:
+        chars = documents.astype('S')
+        dtype = np.uint8
+    except UnicodeEncodeError:
+        chars = documents.astype('U')
+        dtype = np.uint32
+    width = max(chars.dtype.itemsize // np.dtype(dtype).itemsize, 1)
+    chars = np.ascontiguousarray(chars).view(dtype).reshape(len(chars), width)
+
+    isdigit = (chars >= ord('0')) & (chars <= ord('9'))
+    size = isdigit.sum(axis=1)
+    matrix = np.zeros((len(chars), 14), dtype=np.int64)
+    if len(chars) == 0:
+        return matrix, size
+
+    # The layout of the first row is checked directly; only the other rows are
+    # packed and grouped, so a column with a single layout skips the sort
+    same = (isdigit == isdigit[0]).all(axis=1)
+    groups = [np.flatnonzero(same)]
+    rest = np.flatnonzero(~same)
+    if len(rest) > 0:
+        packed = np.ascontiguousarray(np.packbits(isdigit[rest], axis=1))
+        patterns, inverse = np.unique(packed.view(f'V{packed.shape[1]}').ravel(), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(patterns) + 1))
+        groups.extend(rest[order[bounds[k]:bounds[k + 1]]] for k in range(len(patterns)))
+
+    if len(groups) <= max_patterns:
+        for rows in groups:
+            cols = np.flatnonzero(isdigit[rows[0]])
+            if len(cols) <= 14:
+                matrix[rows, 14 - len(cols):] = chars[rows][:, cols] - ord('0')
+    else:
+        position = np.cumsum(isdigit, axis=1)
+        rows, cols = np.nonzero(isdigit)
+        target = 14 - size[rows] + position[rows, cols] - 1
+        keep = (target >= 0) & (size[rows] <= 14)
+        matrix[rows[keep], target[keep]] = chars[rows[keep], cols[keep]] - ord('0')
+
+    return matrix, size
+
+
+def parse_documents(documents):
+
+    # Returns the (n, 14) digit matrix of a column of documents and the CPF and
+    # CNPJ masks, following the same length rules as check_document.
+
+    if isinstance(documents, pd.Series) and pd.api.types.is_numeric_dtype(documents):
+        values = documents.fillna(-1).astype(np.int64).to_numpy()
+    else:
+        values = np.asarray(documents)
+        if values.dtype == object:
+            missing = pd.isna(values)
+            if missing.any():
+                values = values.copy()
+                values[missing] = ''
+
+    matrix, size = _digit_matrix(values)
+    iscpf = (size >= 5) & (size <= 11)
+    iscnpj = (size > 11) & (size <= 14)
+
+    return matrix, iscpf, iscnpj
+
+
+def validate_matrix(matrix, iscpf):
+
+    # Returns the validity of every row of a digit matrix
+
+    d1 = np.where(iscpf, _check_digit(matrix, _CPF_W1), _check_digit(matrix, _CNPJ_W1))
+    matrix2 = matrix.copy()
+    matrix2[:, 12] = d1
+    d2 = np.where(iscpf, _check_digit(matrix2, _CPF_W2), _check_digit(matrix2, _CNPJ_W2))
+
+    # Documents made of a single repeated digit are invalid
+    first = np.where(iscpf, matrix[:, 3], matrix[:, 0])
+    repeated = ((matrix == first[:, None]) | ((np.arange(14) < 3) & iscpf[:, None])).all(axis=1)
+
+    return (d1 == matrix[:, 12]) & (d2 == matrix[:, 13]) & ~repeated
+
+
+def digits_matrix_to_str(matrix, iscpf):
+
+    # CPF digits are shifted to the left; the trailing NULs are dropped on decoding
+    chars = (matrix + ord('0')).astype(np.uint8)
+    chars[iscpf] = np.roll(chars[iscpf], -3, axis=1)
+    chars[iscpf, 11:] = 0
+
+    return chars.view('S14').ravel().astype(str)
+
+
+def check_documents(documents, formatted=True):
+
+    # Batch version of check_document: validates and formats a whole column of
+    # CPF/CNPJ (strings or integers) with matrix operations. Returns a DataFrame
+    # aligned with the input (one row per document, same index for a Series)
+    # with the same attributes as check_document, except document_number. Most
+    # of the time goes into building the output strings; with formatted=False
+    # the document_digits and formatted_document columns are left out.
+
+    index = documents.index if isinstance(documents, pd.Series) else None
+
+    matrix, iscpf, iscnpj = parse_documents(documents)
+    isdoc = iscpf | iscnpj
+    isvalid = validate_matrix(matrix, iscpf)
+
+    out = pd.DataFrame({'document_type': pd.Categorical(np.where(iscpf, 'CPF', np.where(iscnpj, 'CNPJ', None)),
+                                                        categories=['CPF', 'CNPJ']),
+                        'isvalid': pd.arrays.BooleanArray(isvalid, ~isdoc),
+                        'isdocument': isdoc})
+
+    if formatted:
+        doc_digits = np.where(isdoc, digits_matrix_to_str(matrix, iscpf).astype(object), None)
+        out.insert(0, 'document_digits', pd.Series(doc_digits, dtype=object))
+        out.insert(3, 'formatted_document', pd.Series(np.where(isdoc, format_matrix(matrix, iscpf).astype(object), None), dtype=object))
+
+    if index is not None:
+        out.index = index
+
+    return out
@@ -0,0 +1,272 @@
+import numbers
+import numpy as np
+import pandas as pd
+from functools import cached_property
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype, register_series_accessor, take
+from document import parse_documents, validate_matrix, digits_matrix_to_str, format_matrix
+from docindex import CNPJ_FLAG, MISSING
+from cpf_tools import CPF_REGIONS
+
+# Values of DocumentArray._kind
+NA, CPF, CNPJ = 0, 1, 2
+
+_POWERS = 10 ** np.arange(13, -1, -1, dtype=np.uint64)
+
+_REGIONS = np.array([CPF_REGIONS.get(str(i)) for i in range(10)], dtype=object)
+
+
+@register_extension_dtype
+class DocumentDtype(ExtensionDtype):
+    """
+    The pandas dtype of a column of CPF/CNPJ numbers ('document').
+    """
+
+    name = 'document'
+    type = str
+    kind = 'O'
+    na_value = pd.NA
+
+    @classmethod
+    def construct_array_type(cls):
+        return DocumentArray
+
+
+class DocumentArray(ExtensionArray):
+    """
+    A compact column of CPF/CNPJ numbers.
+
+    Each document is stored as its integer value (uint64) plus its type (uint8),
+    9 bytes per row instead of a Python object per attribute. The check digits,
+    the issuing region and the formatted string are computed for the whole
+    column, only when they are first accessed, and then kept. Scalars are the
+    unformatted digits (11 for a CPF, 14 for a CNPJ), or pd.NA when the value is
+    not a document. The length rules are the same as check_document.
+
+    Attributes
+    ----------
+    isvalid : pd.arrays.BooleanArray
+        The validation status of each document (NA when it is not a document).
+    uf : pd.Categorical
+        The state or group of states where each valid CPF was issued.
+    formatted : np.ndarray
+        The formatted documents (None when it is not a document).
+    document_type : pd.Categorical
+        'CPF', 'CNPJ' or NA.
+    encoded : np.ndarray
+        The documents encoded as in docindex, ready for DocumentIndex.contains.
+    """
+
+    def __init__(self, data: np.ndarray, kind: np.ndarray) -> None:
+        self._data = np.asarray(data, dtype=np.uint64)
+        self._kind = np.asarray(kind, dtype=np.uint8)
+
+    @classmethod
+    def from_documents(cls, documents) -> 'DocumentArray':
+        """
+        Builds the array from formatted or unformatted documents (strings or integers).
+        """
+        matrix, iscpf, iscnpj = parse_documents(documents)
+        kind = np.where(iscpf, CPF, np.where(iscnpj, CNPJ, NA)).astype(np.uint8)
+        data = (matrix.astype(np.uint64) @ _POWERS) * (kind != NA)
+        return cls(data, kind)
+
+    @classmethod
+    def from_encoded(cls, values: np.ndarray) -> 'DocumentArray':
+        """
+        Builds the array from documents encoded as in docindex.
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        missing = values == MISSING
+        iscnpj = ((values & CNPJ_FLAG) != 0) & ~missing
+        kind = np.where(missing, NA, np.where(iscnpj, CNPJ, CPF)).astype(np.uint8)
+        return cls(np.where(missing, 0, values & ~CNPJ_FLAG), kind)
+
+    # ExtensionArray interface
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        # Strings and integers that are not documents become NA, as in
+        # from_documents; values that can not hold a document (floats, bools,
+        # other objects) raise TypeError, so pandas keeps their own dtype.
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        if isinstance(scalars, (np.ndarray, pd.Series)) and scalars.dtype.kind in 'iuf':
+            return cls.from_documents(pd.Series(scalars))
+        values = np.asarray(scalars, dtype=object)
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind == 'mixed-integer':
+            valid = all(isinstance(x, (str, numbers.Integral)) and not isinstance(x, bool)
+                        for x in values[~pd.isna(values)])
+        else:
+            valid = kind in ('string', 'integer', 'empty')
+        if not valid:
+            raise TypeError(f"Invalid values for a 'document' column ({kind}).")
+        return cls.from_documents(values)
+
+    @classmethod
+    def _from_sequence_of_strings(cls, strings, *, dtype=None, copy=False):
+        return cls.from_documents(np.asarray(strings, dtype=object))
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls.from_encoded(values)
+
+    @property
+    def dtype(self) -> DocumentDtype:
+        return DocumentDtype()
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes + self._kind.nbytes
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __getitem__(self, item):
+        if isinstance(item, numbers.Integral):
+            kind = self._kind[item]
+            if kind == NA:
+                return pd.NA
+            return f'{int(self._data[item]):0{11 if kind == CPF else 14}d}'
+        item = pd.api.indexers.check_array_indexer(self, item)
+        out = type(self)(self._data[item], self._kind[item])
+        # A slice is a view of the same arrays
+        out._readonly = self._readonly and isinstance(item, slice)
+        return out
+
+    def __setitem__(self, key, value) -> None:
+        if self._readonly:
+            raise ValueError('Cannot modify read-only array')
+        key = pd.api.indexers.check_array_indexer(self, key)
+        if not isinstance(value, DocumentArray):
+            value = DocumentArray._from_sequence([value] if pd.api.types.is_scalar(value) else value)
+        self._data[key] = value._data[0] if len(value) == 1 else value._data
+        self._kind[key] = value._kind[0] if len(value) == 1 else value._kind
+
+        # The lazy attributes were computed for the old values
+        for name in ('isvalid', 'uf', 'formatted'):
+            self.__dict__.pop(name, None)
+
+    def __iter__(self):
+        return iter(self.to_numpy())
+
+    def __array__(self, dtype=None, copy=None):
+        if copy is False:
+            raise ValueError('Unable to avoid copy while creating an array as requested.')
+        return self.to_numpy(dtype=dtype)
+
+    def to_numpy(self, dtype=None, copy=False, na_value=pd.NA):
+        if dtype is not None and np.dtype(dtype) == np.uint64:
+            return self.encoded
+        out = self._matrix_str().astype(object)
+        out[self._kind == NA] = na_value
+        return out if dtype is None else out.astype(dtype)
+
+    def __eq__(self, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        if not isinstance(other, DocumentArray):
+            other = DocumentArray.from_documents(np.atleast_1d(np.asarray(other, dtype=object)))
+        equal = (self._data == other._data) & (self._kind == other._kind)
+        return pd.arrays.BooleanArray(equal, (self._kind == NA) | (other._kind == NA))
+
+    def isna(self) -> np.ndarray:
+        return self._kind == NA
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        if allow_fill and fill_value is not None and not pd.isna(fill_value):
+            fill = DocumentArray.from_documents([fill_value])
+            fill_data, fill_kind = fill._data[0], fill._kind[0]
+        else:
+            fill_data, fill_kind = 0, NA
+        data = take(self._data, indices, allow_fill=allow_fill, fill_value=fill_data)
+        kind = take(self._kind, indices, allow_fill=allow_fill, fill_value=fill_kind)
+        return type(self)(data, kind)
+
+    def copy(self):
+        return type(self)(self._data.copy(), self._kind.copy())
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        return cls(np.concatenate([x._data for x in to_concat]), np.concatenate([x._kind for x in to_concat]))
+
+    def value_counts(self, dropna: bool = True) -> pd.Series:
+        values, counts = np.unique(self.encoded, return_counts=True)
+        if dropna:
+            values, counts = values[values != MISSING], counts[values != MISSING]
+        return pd.Series(pd.array(counts, dtype='Int64'), index=pd.Index(DocumentArray.from_encoded(values)), name='count')
+
+    def _values_for_factorize(self):
+        return self.encoded, MISSING
+
+    def _values_for_argsort(self):
+        return self.encoded
+
+    # Lazy attributes
+
+    def _matrix(self) -> np.ndarray:
+        return ((self._data[:, None] // _POWERS) % 10).astype(np.int64)
+
+    def _matrix_str(self) -> np.ndarray:
+        return digits_matrix_to_str(self._matrix(), self._kind == CPF)
+
+    @property
+    def encoded(self) -> np.ndarray:
+        out = np.where(self._kind == CNPJ, self._data | CNPJ_FLAG, self._data)
+        out[self._kind == NA] = MISSING
+        return out
+
+    @property
+    def document_type(self) -> pd.Categorical:
+        return pd.Categorical.from_codes(self._kind.astype(np.int8) - 1, categories=['CPF', 'CNPJ'])
+
+    @cached_property
+    def isvalid(self) -> pd.arrays.BooleanArray:
+        isvalid = validate_matrix(self._matrix(), self._kind == CPF)
+        return pd.arrays.BooleanArray(isvalid & (self._kind != NA), self._kind == NA)
+
+    @cached_property
+    def uf(self) -> pd.Categorical:
+        region = ((self._data // 100) % 10).astype(np.int64)
+        region = np.where((self._kind == CPF) & self.isvalid.to_numpy(dtype=bool, na_value=False), region, -1)
+        return pd.Categorical.from_codes(region, categories=list(_REGIONS))
+
+    @cached_property
+    def formatted(self) -> np.ndarray:
+        out = format_matrix(self._matrix(), self._kind == CPF).astype(object)
+        out[self._kind == NA] = None
+        return out
+
+
+@register_series_accessor('doc')
+class DocumentAccessor:
+    """
+    Vectorized CPF/CNPJ attributes of a Series (Series.doc).
+
+    Series of any other dtype are converted to a DocumentArray first.
+    """
+
+    def __init__(self, series: pd.Series) -> None:
+        values = series.array
+        self._array = values if isinstance(values, DocumentArray) else DocumentArray.from_documents(series)
+        self._index = series.index
+
+    @property
+    def array(self) -> DocumentArray:
+        return self._array
+
+    @property
+    def isvalid(self) -> pd.Series:
+        return pd.Series(self._array.isvalid, index=self._index, name='isvalid')
+
+    @property
+    def uf(self) -> pd.Series:
+        return pd.Series(self._array.uf, index=self._index, name='uf')
+
+    @property
+    def formatted(self) -> pd.Series:
+        return pd.Series(self._array.formatted, index=self._index, name='formatted', dtype=object)
+
+    @property
+    def document_type(self) -> pd.Series:
+        return pd.Series(self._array.document_type, index=self._index, name='document_type')
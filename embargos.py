@@ -10,14 +10,43 @@ import ssl
 import OpenSSL
 import geopandas as gpd
 import sys
+import os
+import shutil
+import hashlib
+import tempfile
 import shapefile
 from zipfile import is_zipfile, ZipFile
 from io import BytesIO
-from shapely.geometry import Polygon
+import shapely
+from shapely.geometry import Polygon, shape
 import numpy as np
+import time
+import asyncio
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from cache import SnapshotCache
+from sessions import thread_sessions
+from docindex import DocumentIndex, MISSING, encode_matrix
+from document import parse_documents, digits_matrix_to_str
+from wfs import wfs_pages
+from sync import sync_layer
+from geoparquet import write_snapshot
 
 urllib3.disable_warnings()
 
+# Shared on-disk cache for the bulk embargo datasets, created on first use.
+# Replace it to change the directory or the TTL, e.g.
+# embargos.CACHE = SnapshotCache('/data/cache', ttl=3600)
+CACHE = None
+
+
+def _cache():
+
+    global CACHE
+    if CACHE is None:
+        CACHE = SnapshotCache()
+    return CACHE
+
 
 def to_polygon(x):
     try:
@@ -26,108 +55,327 @@ def to_polygon(x):
         return None
 
 
+def _polygons_from_shapes(shapes):
+
+    # Builds every (multi)polygon of a shapefile in one call to
+    # shapely.from_ragged_array. Shapefiles store outer rings clockwise and holes
+    # counterclockwise, and writers usually put each hole after its outer ring,
+    # so the fast path assigns a hole to the last outer ring before it. The
+    # format does not require that order, so shapes with several outer rings
+    # and holes, and any invalid result (e.g. wrongly wound rings), are rebuilt
+    # by pyshp, which assigns each hole to the outer ring that contains it.
+
+    parts = [np.asarray(x.parts, dtype=np.int64) for x in shapes]
+    nparts = np.array([len(x) for x in parts], dtype=np.int64)
+    npoints = np.array([len(x.points) for x in shapes], dtype=np.int64)
+
+    if nparts.sum() == 0:
+        return np.full(len(shapes), None, dtype=object)
+
+    coords = np.concatenate([np.asarray(x.points, dtype=np.float64).reshape(-1, 2) for x in shapes])
+    point_offsets = np.concatenate([[0], np.cumsum(npoints)[:-1]])
+    ring_start = np.concatenate(parts) + np.repeat(point_offsets, nparts)
+    ring_end = np.append(ring_start[1:], len(coords))
+
+    # Signed area of every ring (shoelace), negative for clockwise rings
+    x, y = coords[:, 0], coords[:, 1]
+    cross = np.zeros(len(coords))
+    cross[:-1] = x[:-1] * y[1:] - x[1:] * y[:-1]
+    cross[ring_end - 1] = 0
+    area = np.add.reduceat(cross, ring_start)
+
+    first_ring = np.concatenate([[0], np.cumsum(nparts)[:-1]])
+    exterior = area <= 0
+    exterior[first_ring[nparts > 0]] = True
+
+    ring_offsets = np.append(ring_start, len(coords))
+    polygon_offsets = np.append(np.flatnonzero(exterior), len(ring_start))
+    cumulative = np.concatenate([[0], np.cumsum(exterior)])
+    geom_offsets = np.concatenate([[0], cumulative[first_ring + nparts]])
+
+    geoms = shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, coords,
+                                      (ring_offsets, polygon_offsets, geom_offsets))
+
+    # Single part geometries are returned as Polygon, as the old reader did
+    single = shapely.get_num_geometries(geoms) == 1
+    geoms[single] = shapely.get_geometry(geoms[single], 0)
+    geoms[shapely.is_empty(geoms)] = None
+
+    shape_of_ring = np.repeat(np.arange(len(shapes)), nparts)
+    nexterior = np.bincount(shape_of_ring, weights=exterior, minlength=len(shapes))
+    rebuild = ((nexterior > 1) & (nparts > nexterior)) | ~shapely.is_valid(geoms)
+    rebuild &= nparts > 0
+    for i in np.flatnonzero(rebuild):
+        geoms[i] = shapely.make_valid(shape(shapes[i].__geo_interface__))
+
+    return geoms
+
+
 def read_shp_from_zip(data, encoding='utf-8', crs='EPSG:4326'):
 
-    zip_file = ZipFile(BytesIO(data))
+    # data is the content of the zip file or its path. Each member is
+    # decompressed once; seeking inside a compressed member would inflate it
+    # again from the start
+    zip_file = ZipFile(data if isinstance(data, str) else BytesIO(data))
     fnames = zip_file.namelist()
-    shp = zip_file.open(list(filter(lambda x: '.shp' in x, fnames))[0])
-    shx = zip_file.open(list(filter(lambda x: '.shx' in x, fnames))[0])
-    dbf = zip_file.open(list(filter(lambda x: '.dbf' in x, fnames))[0])
-    prj = zip_file.open(list(filter(lambda x: '.prj' in x, fnames))[0])
+    shp = BytesIO(zip_file.read(list(filter(lambda x: '.shp' in x, fnames))[0]))
+    shx = BytesIO(zip_file.read(list(filter(lambda x: '.shx' in x, fnames))[0]))
+    dbf = BytesIO(zip_file.read(list(filter(lambda x: '.dbf' in x, fnames))[0]))
+    prj = BytesIO(zip_file.read(list(filter(lambda x: '.prj' in x, fnames))[0]))
     r = shapefile.Reader(shp=shp, shx=shx, dbf=dbf, prj=prj, encoding=encoding)
 
-    df = pd.DataFrame.from_dict([x.get('properties') for x in r.__geo_interface__.get('features')])
-    geom = pd.DataFrame.from_dict([x.get('geometry').get('coordinates') for x in r.__geo_interface__.get('features')])[0].values
-    df.insert(df.shape[1], 'geometry', geom)
-    df['geometry'] = df['geometry'].apply(lambda x: to_polygon(x))
+    columns = [x[0] for x in r.fields[1:]]
+    df = pd.DataFrame([list(x) for x in r.iterRecords()], columns=columns)
+
+    if r.shapeType in [shapefile.POLYGON, shapefile.POLYGONZ, shapefile.POLYGONM]:
+        geom = _polygons_from_shapes(r.shapes())
+    else:
+        geom = np.array([shape(x.__geo_interface__) if x.shapeType != shapefile.NULL else None
+                         for x in r.iterShapes()], dtype=object)
+
+    df['geometry'] = geom
     df.dropna(subset=['geometry'], inplace=True)
-    geodf = gpd.GeoDataFrame(df, crs=crs)
+    geodf = gpd.GeoDataFrame(df, geometry='geometry', crs=crs)
 
     return geodf
 
 
-def ibama_doc(document):
+IBAMA_URL = 'https://servicos.ibama.gov.br/ctf/publico/areasembargadas/ConsultaPublicaAreasEmbargadas.php'
 
-    if type(document) is not list:
-        document = [document]
+AMAZONIA_PROTEGE_URL = 'http://amazoniaprotege.mpf.mp.br/geo/dadosProdes/buscaCpfCnpj'
+
+HEADERS = {'Accept-Encoding': 'gzip, deflate, br',
+           'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+           'Connection': 'keep-alive',
+           'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
+
+
+async def _request(session, semaphore, method, url, retries=3, backoff=0.5, **kwargs):
+
+    # Returns (status, content). Server errors (5xx), connection errors and
+    # timeouts are retried with exponential backoff; (None, None) means that
+    # every attempt failed.
+
+    status, content = None, None
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                async with session.request(method, url, **kwargs) as res:
+                    status, content = res.status, await res.read()
+            if status < 500:
+                return status, content
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status, content = None, None
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+    return status, content
+
+
+def _request_sync(session, method, url, retries=3, backoff=0.5, **kwargs):
+
+    # The requests counterpart of _request, used when concurrency is None
+
+    status, content = None, None
+    for attempt in range(retries + 1):
+        try:
+            res = session.request(method, url, **kwargs)
+            status, content = res.status_code, res.content
+            if status < 500:
+                return status, content
+        except requests.RequestException:
+            status, content = None, None
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+
+    return status, content
+
+
+def _client_session(concurrency, timeout):
+
+    # The cookie jar must accept cookies from IP addresses so that the client
+    # also works against a local stub server.
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency, ssl=False),
+                                 cookie_jar=aiohttp.CookieJar(unsafe=True),
+                                 timeout=aiohttp.ClientTimeout(total=timeout),
+                                 headers=HEADERS)
+
+
+def _parse_ibama(status, content):
+
+    if status != 200:
+        return None
+    error = bs(content, 'html.parser').find(attrs={'id': 'erro'})
+    if error is None:
+        return True
+
+    return False if error.get_text() == 'Não há resultados para essa consulta.' else None
 
-    s = requests.Session()
 
-    url = 'https://servicos.ibama.gov.br/ctf/publico/areasembargadas/ConsultaPublicaAreasEmbargadas.php'
+async def ibama_doc_async(document, concurrency=10, retries=3, timeout=60, url=IBAMA_URL):
 
-    headers = {'Accept-Encoding': 'gzip, deflate, br',
-               'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-               'Connection': 'keep-alive',
-               'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
+    documents, unique = _unique_documents(document)
+    if not unique:
+        return [None] * len(documents)
 
-    cookies = s.get(url, headers=headers, verify=False).cookies
+    semaphore = asyncio.Semaphore(concurrency)
 
-    out = []
-    for doc in document:
+    async with _client_session(concurrency, timeout) as session:
+        # The first request only sets the session cookie
+        await _request(session, semaphore, 'GET', url, retries=retries)
+
+        async def query(doc):
+            payload = {'formDinAcao': 'atualizar_grid_Areas_Embargadas_ajax',
+                       'cpf_cnpj': doc}
+            return _parse_ibama(*await _request(session, semaphore, 'POST', url, retries=retries, data=payload))
+
+        found = dict(zip(unique, await asyncio.gather(*[query(doc) for doc in unique])))
+
+    return [found.get(x) for x in documents]
+
+
+def ibama_doc(document, concurrency=None, retries=3, timeout=60, url=IBAMA_URL):
+
+    # With concurrency set, the documents are queried by the asyncio client
+    # using up to concurrency simultaneous connections. url can point to a
+    # local stub server.
+
+    if concurrency is not None:
+        return asyncio.run(ibama_doc_async(document, concurrency=concurrency, retries=retries,
+                                           timeout=timeout, url=url))
+
+    documents, unique = _unique_documents(document)
+    if not unique:
+        return [None] * len(documents)
+
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    s.verify = False
+
+    _request_sync(s, 'GET', url, retries=retries, timeout=timeout)
+
+    found = {}
+    for doc in unique:
         payload = {'formDinAcao': 'atualizar_grid_Areas_Embargadas_ajax',
                    'cpf_cnpj': doc}
-        req = requests.post(url, data=payload, verify=False, cookies=cookies)
-        if req.status_code == 200:
-            try:
-                error = bs(req.content, 'html.parser').find(
-                    attrs={'id': 'erro'}).get_text()
-                out.append(
-                    False) if error == 'Não há resultados para essa consulta.' else out.append(None)
-            except:
-                out.append(True)
-        else:
-            out.append(None)
+        found[doc] = _parse_ibama(*_request_sync(s, 'POST', url, retries=retries, data=payload, timeout=timeout))
 
-    return out
+    return [found.get(x) for x in documents]
 
 
-def icmbio_doc(document):
+def normalize_documents(document):
+
+    # The digits of each CPF (11) or CNPJ (14), zero-padded, or None for
+    # anything that is not a document, with the same rules as check_documents
 
     if type(document) is not list:
         document = [document]
 
-    document = [''.join(filter(str.isdigit, x)) for x in document]
+    matrix, iscpf, iscnpj = parse_documents(pd.Series(document, dtype=object))
+    digits = digits_matrix_to_str(matrix, iscpf)
+
+    return [str(x) if isdoc else None for x, isdoc in zip(digits, iscpf | iscnpj)]
+
+
+def _unique_documents(document):
+
+    # Returns the normalized documents and the distinct ones to be queried;
+    # non-documents are never sent to a server
+    documents = normalize_documents(document)
+    return documents, list(dict.fromkeys(x for x in documents if x is not None))
+
+
+def _load_index(cache, key, source, build):
+
+    # build(data) returns the documents found in the snapshot stored under source
+    cache.derive(key, source, lambda data: DocumentIndex.from_documents(build(data)).to_bytes())
+
+    return DocumentIndex.load(cache.file(key), mmap=True)
+
+
+def _load_icmbio(cache=None):
+
+    cache = _cache() if cache is None else cache
 
     url = 'https://www.gov.br/icmbio/resolveuid/3e86d613f7954424ab6342dae2b6c1d6'
-    req = requests.get(url=url).content
+    req = cache.fetch('icmbio.html', url)
     link = bs(req, 'html.parser').find_all('a', href=re.compile('xlsx'))[0]['href']
-    df = pd.read_excel(link)
-    out = [df['CPF/CNPJ'].isin([x]).any() for x in document]
+    cache.fetch('icmbio.xlsx', link)
 
-    return out
+    def build(data):
+        df = pd.read_excel(BytesIO(data))
+        return df['CPF/CNPJ'].dropna()
 
+    return _load_index(cache, 'icmbio.npy', 'icmbio.xlsx', build)
 
-def amazonia_protege_doc(document):
+
+def icmbio_doc(document):
 
     if type(document) is not list:
         document = [document]
 
-    document = [''.join(filter(str.isdigit, x)) for x in document]
+    out = _load_icmbio().contains(document).tolist()
+
+    return out
 
-    url = 'http://amazoniaprotege.mpf.mp.br/geo/dadosProdes/buscaCpfCnpj'
 
-    s = requests.Session()
+def _parse_amazonia_protege(status, content):
+
+    if status != 200:
+        return None
+    try:
+        return len(json.loads(content)) > 0
+    except ValueError:
+        return None
 
-    headers = {'Accept-Encoding': 'gzip, deflate',
-               'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-               'Connection': 'keep-alive',
-               'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
 
-    cookies = s.get(url, headers=headers, verify=False).cookies
+async def amazonia_protege_doc_async(document, concurrency=10, retries=3, timeout=60, url=AMAZONIA_PROTEGE_URL):
 
-    out = []
-    for doc in document:
-        params = {'cpfCnpj': doc}
-        res = s.get(url=url, params=params, cookies=cookies).json()
-        out.append(len(res) > 0)
+    documents, unique = _unique_documents(document)
+    if not unique:
+        return [None] * len(documents)
 
-    return out
+    semaphore = asyncio.Semaphore(concurrency)
 
+    async with _client_session(concurrency, timeout) as session:
+        await _request(session, semaphore, 'GET', url, retries=retries)
 
-def sema_mt_doc(document):
+        async def query(doc):
+            res = await _request(session, semaphore, 'GET', url, retries=retries, params={'cpfCnpj': doc})
+            return _parse_amazonia_protege(*res)
 
-    if type(document) is not list:
-        document = [document]
+        found = dict(zip(unique, await asyncio.gather(*[query(doc) for doc in unique])))
+
+    return [found.get(x) for x in documents]
+
+
+def amazonia_protege_doc(document, concurrency=None, retries=3, timeout=60, url=AMAZONIA_PROTEGE_URL):
+
+    if concurrency is not None:
+        return asyncio.run(amazonia_protege_doc_async(document, concurrency=concurrency, retries=retries,
+                                                      timeout=timeout, url=url))
+
+    documents, unique = _unique_documents(document)
+    if not unique:
+        return [None] * len(documents)
+
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    s.verify = False
+
+    _request_sync(s, 'GET', url, retries=retries, timeout=timeout)
+
+    found = {}
+    for doc in unique:
+        res = _request_sync(s, 'GET', url, retries=retries, params={'cpfCnpj': doc}, timeout=timeout)
+        found[doc] = _parse_amazonia_protege(*res)
+
+    return [found.get(x) for x in documents]
+
+
+def _load_sema_mt(cache=None):
+
+    cache = _cache() if cache is None else cache
 
     url = 'https://geo.sema.mt.gov.br/geoserver/semamt/ows'
 
@@ -139,91 +387,305 @@ def sema_mt_doc(document):
                # 'srsname': 'EPSG:100005',
                'outputFormat': 'application/json'}
 
-    s = requests.Session()
-    data = s.post(url, data=payload).json()
-    feature = gpd.GeoDataFrame(data.get('features'))
-    data = pd.DataFrame([x.get('properties') for x in data.get('features')])
-    resume = data.replace(' ', None).dropna(subset=['CPF_CNPJ']).groupby(['CPF_CNPJ']).agg({'NOME': 'count', 'AREA': 'sum'}).reset_index()
-    out = [resume['CPF_CNPJ'].isin([x]).any() for x in document]
+    cache.fetch('sema_mt.json', url, method='post', data=payload)
+
+    def build(data):
+        data = json.loads(data)
+        data = pd.DataFrame([x.get('properties') for x in data.get('features')])
+        data = data.replace(' ', None).dropna(subset=['CPF_CNPJ'])
+        return data['CPF_CNPJ']
+
+    return _load_index(cache, 'sema_mt.npy', 'sema_mt.json', build)
+
+
+def sema_mt_doc(document):
+
+    if type(document) is not list:
+        document = [document]
+
+    out = _load_sema_mt().contains(document).tolist()
 
     return out
 
 
+def _load_semas_pa(cache=None):
+
+    cache = _cache() if cache is None else cache
+
+    url = 'https://monitoramento.semas.pa.gov.br/ldi/regioesdesmatamento/downloadcsvareasfile'
+    cache.fetch('semas_pa.csv', url)
+
+    def build(data):
+        df = pd.read_csv(BytesIO(data), encoding='latin-1', sep=';',
+                         on_bad_lines='skip', skiprows=2, decimal=',')
+        tmp = (df['Proprietário - CPF/CNPJ'].str.split(' - ', expand=True)
+               ).iloc[:, 0:2].rename(columns={0: 'Nome', 1: 'CPF_CNPJ'})
+        return tmp['CPF_CNPJ'].dropna()
+
+    return _load_index(cache, 'semas_pa.npy', 'semas_pa.csv', build)
+
+
 def semas_pa_doc(document):
 
     if type(document) is not list:
         document = [document]
 
-    url = 'https://monitoramento.semas.pa.gov.br/ldi/regioesdesmatamento/downloadcsvareasfile'
-    df = pd.read_csv(url, encoding='latin-1', sep=';',
-                     on_bad_lines='skip', skiprows=2, decimal=',')
-    tmp = (df['Proprietário - CPF/CNPJ'].str.split(' - ', expand=True)
-           ).iloc[:, 0:2].rename(columns={0: 'Nome', 1: 'CPF_CNPJ'})
-    df['Nome'] = tmp['Nome']
-    df['CPF_CNPJ'] = tmp['CPF_CNPJ']
-    out = [df['CPF_CNPJ'].isin([x]).any() for x in document]
+    out = _load_semas_pa().contains(document).tolist()
+
+    return out
+
+
+SOURCES = {'ibama': ibama_doc,
+           'icmbio': icmbio_doc,
+           'amazonia_protege': amazonia_protege_doc,
+           'sema_mt': sema_mt_doc,
+           'semas_pa': semas_pa_doc}
+
+# Bulk sources are screened directly against their document index
+BULK_LOADERS = {'icmbio': _load_icmbio,
+                'sema_mt': _load_sema_mt,
+                'semas_pa': _load_semas_pa}
+
+
+def screen_documents(docs, sources=None, concurrency=16, retries=3, urls=None):
+
+    # Screens a list of CPF/CNPJ against every embargo source in a single run.
+    # Per-document APIs are queried by the asyncio client with up to concurrency
+    # simultaneous requests each, and each bulk source is downloaded only once.
+    # urls optionally maps a per-document source to another address (e.g. a
+    # local stub server). The time spent in each source is stored in
+    # out.attrs['timings'] (seconds).
+
+    urls = {} if urls is None else urls
+
+    if sources is None:
+        sources = list(SOURCES.keys())
+
+    unknown = [x for x in sources if x not in SOURCES]
+    if len(unknown) > 0:
+        sys.exit('Error: Unknown source(s) ' + ', '.join(unknown) + '. Try ' + ', '.join(SOURCES.keys()) + '.')
+
+    if type(docs) is not list:
+        docs = [docs]
+
+    # Every document is parsed once; the distinct ones come out of np.unique
+    # already sorted, so no index sorts them again. The rows that are not
+    # documents (MISSING, the last code) point past the last result, to a None.
+    matrix, iscpf, iscnpj = parse_documents(pd.Series(docs, dtype=object))
+    codes, first, inverse = np.unique(encode_matrix(matrix, iscpf, iscnpj), return_index=True, return_inverse=True)
+    if len(codes) > 0 and codes[-1] == MISSING:
+        codes, first = codes[:-1], first[:-1]
+    unique = digits_matrix_to_str(matrix[first], iscpf[first]).tolist()
+
+    def run(source):
+        start = time.perf_counter()
+        try:
+            if source in BULK_LOADERS:
+                result = BULK_LOADERS.get(source)().contains(codes).tolist()
+            else:
+                options = {'url': urls.get(source)} if source in urls else {}
+                result = SOURCES.get(source)(unique, concurrency=concurrency, retries=retries, **options)
+        except Exception as e:
+            print('Warning: The source ' + source + ' failed (' + str(e) + ').')
+            result = [None] * len(unique)
+        return source, result, time.perf_counter() - start
+
+    isdoc = iscpf | iscnpj
+    out = pd.DataFrame({'documento': pd.Series(np.where(isdoc, digits_matrix_to_str(matrix, iscpf).astype(object), None), dtype=object)})
+    timings = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(sources))) as executor:
+        for source, result, elapsed in executor.map(run, sources):
+            column = np.full(len(unique) + 1, None, dtype=object)
+            column[:len(unique)] = result
+            out[source] = column[inverse]
+            timings[source] = elapsed
+
+    out.attrs['timings'] = timings
+
+    return out
+
+
+def _download(session, url, fname, params=None, chunk_size=1 << 20):
+
+    # Streams the response to fname in chunks and returns its SHA-256. The data
+    # is written to a temporary file first, so fname is never left incomplete.
+
+    sha = hashlib.sha256()
+    tmp = fname + '.part'
+    with session.get(url, params=params, stream=True) as req:
+        req.raise_for_status()
+        with open(tmp, 'wb') as f:
+            for chunk in req.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                sha.update(chunk)
+    os.replace(tmp, fname)
+
+    return sha.hexdigest()
+
+
+def _write_pages(pages, outfile=None, engine=None, table=None):
+
+    # Writes each page as soon as it arrives and returns the number of rows.
+    # Files ending in .parquet are written as a GeoParquet snapshot partitioned
+    # by uf (one part per page), any other extension goes through to_file
+    # (e.g. GeoPackage).
+
+    total = 0
+    for i, page in enumerate(pages):
+        if outfile is not None:
+            if outfile.endswith('.parquet'):
+                write_snapshot(page, outfile, partition_cols=['uf'], part='part-{:05d}'.format(i), overwrite=i == 0)
+            else:
+                page.to_file(outfile, mode='w' if i == 0 else 'a')
+        if engine is not None:
+            page.to_postgis(name=table, con=engine, if_exists='replace' if i == 0 else 'append', schema='public')
+        total += len(page)
+
+    return total
+
+
+def _save(out, outfile):
+
+    # .parquet files are written as GeoParquet snapshots partitioned by uf
+    if outfile.endswith('.parquet'):
+        write_snapshot(out, outfile, partition_cols=['uf'] if 'uf' in out.columns else None)
+    else:
+        out.to_file(outfile)
+
+
+IBAMA_WFS_URL = 'http://siscom.ibama.gov.br/geoserver/publica/ows'
+
+IBAMA_LAYER = 'publica:vw_brasil_adm_embargo_a'
+
+
+def _ibama_columns(out):
+
+    out = out[['nom_pessoa', 'cpf_cnpj_infrator', 'nom_municipio', 'sig_uf', 'geometry']]
+    out.columns = ['nome', 'documento', 'municipio', 'uf', 'geometry']
 
     return out
 
 
-def ibama_geospatial(save=False, outfile=None, to_sql=False, engine=None):
+def ibama_geospatial(save=False, outfile=None, to_sql=False, engine=None, stream=False, page_size=10000, workers=4,
+                     sync=False):
+
+    # With stream=True the layer is paged through WFS (page_size features per
+    # request, workers pages in parallel) and each page is written to outfile
+    # and/or the SQL table as it arrives. Only the number of rows is returned,
+    # so the memory used does not grow with the size of the layer.
+    # With sync=True the SQL table is updated incrementally (see sync.sync_layer)
+    # instead of replaced; the changes are stored in out.attrs['sync'].
+
+    if save and outfile is None:
+        sys.exit('Error: You must provide a path to save the file. Set the "outfile" argument.')
+    if to_sql and engine is None:
+        sys.exit('Error: You must provide an engine when save the data in SQL server.')
+    if stream and sync:
+        sys.exit('Error: The sync mode needs the whole layer and cannot be used with stream=True.')
 
     s = requests.Session()
 
+    if stream:
+        if not (save or to_sql):
+            sys.exit('Error: The stream mode needs a target. Set "save" and/or "to_sql".')
+        pages = wfs_pages(IBAMA_WFS_URL, IBAMA_LAYER, page_size=page_size, workers=workers, session=s)
+        return _write_pages((_ibama_columns(x) for x in pages), outfile if save else None,
+                            engine if to_sql else None, 'embargos_ibama')
+
     payload = {'service': 'WFS',
                'version': '2.0.0',
                'request': 'GetFeature',
-               'typeName': 'publica:vw_brasil_adm_embargo_a',
+               'typeName': IBAMA_LAYER,
                'outputFormat': 'application/json'}
 
-    url = 'http://siscom.ibama.gov.br/geoserver/publica/ows'
-    df = s.post(url, payload)
+    df = s.post(IBAMA_WFS_URL, payload)
 
     if df.ok:
         out = gpd.GeoDataFrame().from_features(df.json())
-        out.columns
-        out = out[['nom_pessoa', 'cpf_cnpj_infrator', 'nom_municipio', 'sig_uf', 'geometry']]
         out.set_crs('EPSG:4326', inplace=True)
-        out.columns = ['nome', 'documento', 'municipio', 'uf', 'geometry']
+        out = _ibama_columns(out)
         # out.insert(4, 'area', out.to_crs('EPSG:32722').area / 1e4)
         # emb_ibama['data_tad'] = pd.to_datetime(emb_ibama['data_tad'].str.replace('Z',''))
         # emb_ibama['data_geom'] = pd.to_datetime(emb_ibama['data_geom'].str.replace('Z',''))
         if save:
-            if outfile is None:
-                sys.exit('Error: You must provide a path to save the file. Set the "outfile" argument.')
-            out.to_file(outfile)
+            _save(out, outfile)
         if to_sql:
-            if engine is None:
-                sys.exit('Error: You must provide an engine when save the data in SQL server.')
-            out.to_postgis(name='embargos_ibama', con=engine, if_exists='replace', schema='public')
+            if sync:
+                out.attrs['sync'] = sync_layer(out, 'embargos_ibama', engine, schema='public')
+                print('embargos_ibama: ' + ', '.join(str(v) + ' ' + k for k, v in out.attrs['sync'].items()))
+            else:
+                out.to_postgis(name='embargos_ibama', con=engine, if_exists='replace', schema='public')
         return out
     else:
         print('Error: The website is down. Try again later.')
         return -1
 
 
-def icmbio_geospatial(save=False, outfile=None, to_sql=False, engine=None):
+def _icmbio_columns(out):
+
+    out = out[['autuado', 'cpf_cnpj', 'municipio', 'uf', 'nome_uc', 'geometry']]
+    out.columns = ['nome', 'documento', 'municipio', 'uf', 'nome_da_uc', 'geometry']
+
+    return out.to_crs('EPSG:4326')
+
+
+def _read_file_pages(fname, page_size):
+
+    start = 0
+    while True:
+        page = gpd.read_file(fname, rows=slice(start, start + page_size))
+        if len(page) == 0:
+            return
+        yield page
+        start += page_size
+
+
+def icmbio_geospatial(save=False, outfile=None, to_sql=False, engine=None, stream=False, page_size=10000, sync=False):
+
+    # ICMBio publishes a zipped shapefile instead of a WFS layer. With
+    # stream=True the archive is streamed to a temporary file and read back
+    # page_size features at a time, each page being written as it is read.
+    # sync=True updates the SQL table incrementally, as in ibama_geospatial.
+
+    if save and outfile is None:
+        sys.exit('Error: You must provide a path to save the file. Set the "outfile" argument.')
+    if to_sql and engine is None:
+        sys.exit('Error: You must provide an engine when save the data in SQL server.')
+    if stream and sync:
+        sys.exit('Error: The sync mode needs the whole layer and cannot be used with stream=True.')
 
     url = 'https://www.gov.br/icmbio/resolveuid/3e86d613f7954424ab6342dae2b6c1d6'
     req = requests.get(url=url)
     if req.ok:
         link = bs(req.content, 'html.parser')
         link = link.find_all('a', href=re.compile('shp'))[0]['href']
+
+        if stream:
+            if not (save or to_sql):
+                sys.exit('Error: The stream mode needs a target. Set "save" and/or "to_sql".')
+            folder = tempfile.mkdtemp()
+            try:
+                fname = os.path.join(folder, 'icmbio.zip')
+                _download(requests.Session(), link, fname)
+                pages = (_icmbio_columns(x) for x in _read_file_pages(fname, page_size))
+                return _write_pages(pages, outfile if save else None, engine if to_sql else None, 'embargos_icmbio')
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+
         out = gpd.read_file(link, crs='EPSG:4326')
-        out = out[['autuado', 'cpf_cnpj', 'municipio', 'uf', 'nome_uc', 'geometry']]
-        out.columns = ['nome', 'documento', 'municipio', 'uf', 'nome_da_uc', 'geometry']
+        out = _icmbio_columns(out)
         # out.insert(5, 'area', out.to_crs('EPSG:32722').area / 1e4)
-        out.to_crs('EPSG:4326', inplace=True)
 
         if save:
-            if outfile is None:
-                sys.exit('Error: You must provide a path to save the file. Set the "outfile" argument.')
-            out.to_file(outfile)
+            _save(out, outfile)
 
         if to_sql:
-            if engine is None:
-                sys.exit('Error: You must provide an engine when save the data in SQL server.')
-            out.to_postgis(name='embargos_icmbio', con=engine, if_exists='replace', schema='public')
+            if sync:
+                out.attrs['sync'] = sync_layer(out, 'embargos_icmbio', engine, schema='public')
+                print('embargos_icmbio: ' + ', '.join(str(v) + ' ' + k for k, v in out.attrs['sync'].items()))
+            else:
+                out.to_postgis(name='embargos_icmbio', con=engine, if_exists='replace', schema='public')
 
         return out
     else:
@@ -231,40 +693,56 @@ def icmbio_geospatial(save=False, outfile=None, to_sql=False, engine=None):
         return -1
 
 
-def ldi_pa_geoespacial(save=False, outpath=None, type='all'):
+LDI_PA_URL = 'https://monitoramento.semas.pa.gov.br/ldi/regioesdesmatamento/baixartodosshapefile'
+
+
+def ldi_pa_geoespacial(save=False, outpath=None, type='all', snapshot=None):
+
+    # With save=True the archives are only written to outpath (next to a
+    # .sha256 file) and the checksums are returned; the shapefiles are parsed
+    # only when a GeoDataFrame is returned. snapshot is an optional path where
+    # the returned GeoDataFrame is also written as GeoParquet.
 
     if type not in ['automatizado', 'manual', 'all']:
         print('Erro! O tipo retornado deve ser "automatizado", "manual" ou "all".')
         sys.exit()
 
-    url = 'https://monitoramento.semas.pa.gov.br/ldi/regioesdesmatamento/baixartodosshapefile'
+    if save and outpath is None:
+        sys.exit('Error: You must provide a path to save the files. Set the "outpath" argument.')
 
-    s = requests.Session()
+    url = LDI_PA_URL
 
-    auto = s.get(url, params={'tipoShape': 'AUTOMATIZADO'})
-    manual = s.get(url, params={'tipoShape': 'MANUAL'})
+    variants = ['automatizado', 'manual'] if type.lower() == 'all' else [type.lower()]
+    folder = outpath if save else tempfile.mkdtemp()
+    files = {x: os.path.join(folder, 'ldi_' + x + '.zip') for x in variants}
 
-    auto_df = read_shp_from_zip(data=auto.content, encoding='latin1').replace('', None)
-    manual_df = read_shp_from_zip(data=manual.content, encoding='latin1').replace('', None)
+    try:
+        with thread_sessions() as session, ThreadPoolExecutor(max_workers=len(variants)) as executor:
+            checksums = executor.map(lambda x: _download(session(), url, files.get(x), {'tipoShape': x.upper()}), variants)
+            checksums = dict(zip(variants, checksums))
 
-    if type.lower() == 'automatizado':
         if save:
-            open(outpath + 'ldi_automatizado.zip', 'wb').write(auto.content)
-        else:
-            return auto_df
-    elif type.lower() == 'manual':
-        if save:
-            open(outpath + 'ldi_manual.zip', 'wb').write(manual.content)
-        else:
-            return manual_df
-    else:
-        if save:
-            open(outpath + 'ldi_automatizado.zip', 'wb').write(auto.content)
-            open(outpath + 'ldi_manual.zip', 'wb').write(manual.content)
-        else:
-            auto_df['tipo'] = 'automatizado'
-            manual_df['tipo'] = 'manual'
-            return pd.concat([auto_df, manual_df], ignore_index=True)
+            for x in variants:
+                with open(files.get(x) + '.sha256', 'w') as f:
+                    f.write(checksums.get(x) + '  ' + os.path.basename(files.get(x)) + '\n')
+            return checksums
+
+        out = []
+        for x in variants:
+            df = read_shp_from_zip(data=files.get(x), encoding='latin1').replace('', None)
+            if type.lower() == 'all':
+                df['tipo'] = x
+            out.append(df)
+    finally:
+        if not save:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    out = out[0] if len(out) == 1 else pd.concat(out, ignore_index=True)
+
+    if snapshot is not None:
+        write_snapshot(out, snapshot, partition_cols=['tipo'] if 'tipo' in out.columns else None)
+
+    return out
 
 
 # from sqlalchemy import create_engine
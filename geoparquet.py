@@ -0,0 +1,79 @@
+import os
+import shutil
+import pandas as pd
+import geopandas as gpd
+
+
+def write_snapshot(gdf: gpd.GeoDataFrame, path: str, partition_cols: list = None,
+                   row_group_size: int = 20000, part: str = 'part-00000', overwrite: bool = True) -> None:
+    """
+    Writes a layer as a GeoParquet snapshot.
+
+    Rows are sorted along a Hilbert curve before writing, so each row group
+    covers a small area and its bbox statistics (written as a covering bbox
+    column) let readers skip most row groups of a bbox query. With
+    partition_cols the snapshot is a hive-partitioned directory
+    (path/uf=PA/part-00000.parquet); otherwise it is a single file.
+
+    Parameters
+    ----------
+        gdf : gpd.GeoDataFrame
+            The layer to be written.
+        path : str
+            The output file (or directory when partitioned).
+        partition_cols : list
+            The columns used to partition the snapshot (e.g. ['uf']).
+        row_group_size : int
+            The number of rows per row group.
+        part : str
+            The file name used inside each partition. Writing several parts with
+            overwrite=False appends them to the same snapshot.
+        overwrite : bool
+            Removes any previous snapshot at path before writing.
+    """
+    if overwrite:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    if len(gdf) > 0 and not gdf.geometry.is_empty.all():
+        gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort(kind='stable')]
+
+    kwargs = {'write_covering_bbox': True, 'row_group_size': row_group_size, 'index': False}
+
+    if not partition_cols:
+        gdf.to_parquet(path, **kwargs)
+        return
+
+    for keys, group in gdf.groupby(partition_cols, dropna=False, observed=True):
+        keys = keys if isinstance(keys, tuple) else (keys,)
+        folder = os.path.join(path, *[f'{c}={"__HIVE_DEFAULT_PARTITION__" if pd.isna(k) else k}'
+                                      for c, k in zip(partition_cols, keys)])
+        os.makedirs(folder, exist_ok=True)
+        group.drop(columns=partition_cols).to_parquet(os.path.join(folder, part + '.parquet'), **kwargs)
+
+
+def read_snapshot(path: str, columns: list = None, bbox: tuple = None, filters: list = None, **kwargs) -> gpd.GeoDataFrame:
+    """
+    Reads a GeoParquet snapshot written by write_snapshot.
+
+    Parameters
+    ----------
+        path : str
+            The snapshot file or directory.
+        columns : list
+            Reads only these columns (the geometry must be listed to be kept).
+        bbox : tuple
+            (minx, miny, maxx, maxy): reads only the row groups, and then the
+            rows, whose bbox intersects it.
+        filters : list
+            pyarrow filters, e.g. [('uf', 'in', ['PA', 'MT'])] to read only
+            some partitions.
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        The snapshot. Partition columns are returned as categoricals.
+    """
+    return gpd.read_parquet(path, columns=columns, bbox=bbox, filters=filters, **kwargs)
@@ -1,34 +1,185 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import shapely
+import threading
 import requests
+import urllib3
 import pandas as pd
-import numpy as np
-from bs4 import BeautifulSoup
 import geopandas as gpd
-import ssl
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from wfs import wfs_hits, wfs_pages, geojson_page
+from geoparquet import write_snapshot
 
-ssl._create_default_https_context = ssl._create_unverified_context
+urllib3.disable_warnings()
 
-s = requests.Session()
+WFS_URL = 'http://acervofundiario.incra.gov.br/i3geo/ogc.php'
 
-url = 'https://servicodados.ibge.gov.br/api/v1/localidades/estados'
-uf = s.get(url, params = {'view': 'nivelado'}).json()
-uf = [x.get('UF-sigla').lower() for x in uf]
+UFS = ['ac', 'al', 'am', 'ap', 'ba', 'ce', 'df', 'es', 'go', 'ma', 'mg', 'ms', 'mt', 'pa',
+       'pb', 'pe', 'pi', 'pr', 'rj', 'rn', 'ro', 'rr', 'rs', 'sc', 'se', 'sp', 'to']
 
-url = 'http://acervofundiario.incra.gov.br/i3geo/ogc.php'
 
-payload = [{'tema': 'certificada_sigef_particular_{}'.format(x),
-            'version': '2.0.0',
-            'srsname': 'EPSG:4326',
-            'typename': 'ms:certificada_sigef_particular_{}'.format(x),
-            'service': 'WFS',
-            'request': 'GetFeature',
-            'outputFormat': 'GML3'} for x in uf]
+def gml_page(content: bytes, crs: str = 'EPSG:4326') -> gpd.GeoDataFrame:
+    """Parses a GML GetFeature response."""
+    gdf = gpd.read_file(BytesIO(content))
+    return gdf.set_crs(crs, allow_override=True) if len(gdf) > 0 else gpd.GeoDataFrame(geometry=[], crs=crs)
 
-out = gpd.read_file(s.get(url, params=payload[0], verify=False).url)
 
-headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/105.0.0.0 Safari/537.36',
-           'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-           'Accept-Encoding': 'gzip, deflate, br',
-           'Host': 'sigef.incra.gov.br',
-           'sec-ch-ua': '"Google Chrome";v="105", "Not)A;Brand";v="8", "Chromium";v="105"'}
+def _params(uf):
 
-BeautifulSoup(s.get('https://sigef.incra.gov.br/geo/parcela/detalhe/714be5ee-e0cb-494c-8f6a-5deb39975179/', verify=False, headers=headers).text)
+    layer = 'certificada_sigef_particular_{}'.format(uf)
+    return layer, {'tema': layer, 'srsname': 'EPSG:4326'}
+
+
+def _features_hash(gdf):
+
+    # Hashes the parsed features (attributes by column name plus normalized
+    # WKB), so response metadata such as the WFS timeStamp does not count
+    attributes = gdf.drop(columns=gdf.geometry.name)
+    attributes = attributes[sorted(attributes.columns)].astype(str).agg('\x1f'.join, axis=1)
+    wkb = shapely.to_wkb(shapely.normalize(gdf.geometry.values))
+    rows = sorted(hashlib.sha256(x.encode('utf-8') + (g or b'')).digest() for x, g in zip(attributes, wkb))
+    return hashlib.sha256(b''.join(rows)).hexdigest()
+
+
+def _fingerprint(session, uf, output_format, probe_size, sort_by):
+
+    # The number of features and a hash of the last features of the layer
+    # (ordered by sort_by): new certifications change both, without
+    # downloading the whole state
+    layer, params = _params(uf)
+    total = wfs_hits(WFS_URL, 'ms:' + layer, session=session, **params)
+    if total is None:
+        return None
+    payload = {'service': 'WFS',
+               'version': '2.0.0',
+               'request': 'GetFeature',
+               'typeNames': 'ms:' + layer,
+               'outputFormat': output_format,
+               'startIndex': max(total - probe_size, 0),
+               'count': probe_size}
+    if sort_by:
+        payload['sortBy'] = sort_by
+    payload.update(params)
+    req = session.get(WFS_URL, params=payload)
+    req.raise_for_status()
+    parse = geojson_page if 'json' in output_format.lower() else gml_page
+    return {'count': total, 'probe': _features_hash(parse(req.content))}
+
+
+def _download_state(session, uf, path, output_format, page_size, workers, sort_by):
+
+    # Pages are requested in sort_by order, as the fingerprint probe is, so
+    # startIndex paging neither skips nor repeats features
+    layer, params = _params(uf)
+    if sort_by:
+        params = dict(params, sortBy=sort_by)
+    parse = geojson_page if 'json' in output_format.lower() else gml_page
+
+    # The state is written to a temporary folder and swapped in at the end, so
+    # a failed download keeps the previous data
+    tmp = os.path.join(path, '.tmp-' + uf)
+    shutil.rmtree(tmp, ignore_errors=True)
+    features = 0
+    pages = wfs_pages(WFS_URL, 'ms:' + layer, page_size=page_size, workers=workers, session=session,
+                      parse=parse, output_format=output_format, **params)
+    for i, page in enumerate(pages):
+        page['uf'] = uf.upper()
+        write_snapshot(page, tmp, partition_cols=['uf'], part='part-{:05d}'.format(i), overwrite=False)
+        features += len(page)
+
+    target = os.path.join(path, 'uf=' + uf.upper())
+    shutil.rmtree(target, ignore_errors=True)
+    if features > 0:
+        os.replace(os.path.join(tmp, 'uf=' + uf.upper()), target)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    return features
+
+
+def get_sigef(path: str = 'sigef_parcelas', ufs: list = None, workers: int = 4, page_workers: int = 2,
+              page_size: int = 5000, output_format: str = 'GML3', refresh: bool = False,
+              probe_size: int = 100, sort_by: str = 'parcela_co') -> pd.DataFrame:
+    """
+    Downloads the certified private parcels (SIGEF) of each state from the
+    INCRA WFS into a GeoParquet dataset partitioned by UF (path/uf=PA/...).
+
+    Up to workers states are downloaded at the same time, and each state is
+    paged through with up to page_workers pages in flight, so the memory used
+    does not depend on the size of the state. A manifest (path/_manifest.json)
+    keeps the number of features and a hash of the last features of each
+    state; later calls download only the states whose fingerprint changed.
+
+    Parameters
+    ----------
+        path : str
+            The dataset folder.
+        ufs : list
+            The states to download (all 27 if None).
+        workers : int
+            The number of states downloaded concurrently.
+        page_workers : int
+            The number of pages fetched concurrently for each state.
+        page_size : int
+            The number of features per page.
+        output_format : str
+            'GML3' (the default of the service) or a GeoJSON format.
+        refresh : bool
+            Downloads every state, even the unchanged ones.
+        probe_size : int
+            The number of features hashed to detect changes.
+        sort_by : str
+            The attribute that orders the features (WFS sortBy), so the same
+            features are hashed on every run and pages do not overlap.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per state: its status ('updated', 'unchanged' or 'failed'),
+        the number of features, the elapsed time and the error, if any.
+    """
+    ufs = UFS if ufs is None else [x.lower() for x in ufs]
+    os.makedirs(path, exist_ok=True)
+
+    manifest_file = os.path.join(path, '_manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    lock = threading.Lock()
+
+    def run(uf):
+        start = time.monotonic()
+        s = requests.Session()
+        s.verify = False
+        try:
+            fingerprint = _fingerprint(s, uf, output_format, probe_size, sort_by)
+            previous = manifest.get(uf.upper(), {})
+            stored = os.path.isdir(os.path.join(path, 'uf=' + uf.upper())) or previous.get('features') == 0
+            if not refresh and fingerprint is not None and previous.get('fingerprint') == fingerprint and stored:
+                return {'uf': uf.upper(), 'status': 'unchanged', 'features': previous.get('features'),
+                        'seconds': time.monotonic() - start, 'error': None}
+
+            features = _download_state(s, uf, path, output_format, page_size, page_workers, sort_by)
+
+            with lock:
+                manifest[uf.upper()] = {'fingerprint': fingerprint, 'features': features, 'updated_at': time.time()}
+                tmp = manifest_file + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(manifest, f, indent=1)
+                os.replace(tmp, manifest_file)
+
+            return {'uf': uf.upper(), 'status': 'updated', 'features': features,
+                    'seconds': time.monotonic() - start, 'error': None}
+
+        except Exception as e:
+            return {'uf': uf.upper(), 'status': 'failed', 'features': None,
+                    'seconds': time.monotonic() - start, 'error': f'{type(e).__name__}: {e}'}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        report = pd.DataFrame(list(executor.map(run, ufs)))
+
+    return report
@@ -6,6 +6,11 @@ import numpy as np
 import pandas as pd
 import sys
 import datetime as dt
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sessions import thread_sessions
+from units import convert_price
 
 
 def format_doc(x):
@@ -75,6 +80,57 @@ def car_mt(cpf):
         return None
 
 
+CME_URL = 'https://www.cmegroup.com/CmeWS/mvc/Quotes/Future/{}/G?quoteCodes=null&_=1560171518204'
+CME_HEADERS = {'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
+               'Accept-Encoding': 'gzip, deflate, br',
+               'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+               'Connection': 'keep-alive',
+               'Host': 'www.cmegroup.com',
+               'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
+CME_PRODUCTS = {'dollar': '40', 'soybeans': '320', 'corn': '300', 'oats': '331'}
+
+_fx_cache = {'fetched_at': None, 'curve': None}
+_fx_lock = threading.Lock()
+
+
+def _cme_curve(s, product, column):
+
+    quotes = s.get(CME_URL.format(CME_PRODUCTS.get(product)), headers=CME_HEADERS).json().get('quotes')
+    curve = pd.DataFrame(quotes)[['expirationDate', 'priorSettle']]
+    curve.columns = ['Data', column]
+    curve['Data'] = pd.to_datetime(curve['Data'], format='%Y%m%d')
+    return curve
+
+
+def _crop_curve(s, crop):
+
+    curve = _cme_curve(s, crop, 'Preço')
+    curve['Preço'] = curve['Preço'].str.replace("'", '.').astype(float)
+    return curve
+
+
+def dollar_curve(ttl=60, session=None):
+
+    # The BRL futures curve in R$ per US$, shared by every crop and kept for
+    # ttl seconds, so intraday polling does not download it again
+    with _fx_lock:
+        fetched_at = _fx_cache.get('fetched_at')
+        if fetched_at is None or time.time() - fetched_at >= ttl:
+            currency = _cme_curve(requests.Session() if session is None else session, 'dollar', 'Taxa')
+            currency['Taxa'] = 1 / currency['Taxa'].replace('-', None).astype(float)
+            _fx_cache.update(fetched_at=time.time(), curve=currency)
+        return _fx_cache.get('curve').copy()
+
+
+def _to_bag(crop_price, crop, currency):
+
+    crop_price = crop_price.merge(currency, how='inner', on='Data')
+
+    # US cents per bushel to R$ per 60 kg bag
+    crop_price['Preço'] = convert_price(crop_price['Preço'], 'BU', 'bag60', crop, fx=crop_price['Taxa'] / 100)
+    return crop_price
+
+
 def cbot_commodity_price(crop=None, year=None, month=None):
 
     # This code gets the commodities prices in CBOT website
@@ -88,33 +144,7 @@ def cbot_commodity_price(crop=None, year=None, month=None):
 
     s = requests.Session()
 
-    headers = {'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-               'Accept-Encoding': 'gzip, deflate, br',
-               'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-               'Connection': 'keep-alive',
-               'Host': 'www.cmegroup.com',
-               'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
-
-    url = 'https://www.cmegroup.com/CmeWS/mvc/Quotes/Future/{}/G?quoteCodes=null&_=1560171518204'
-    productIds = {'dollar': '40', 'soybeans': '320', 'corn': '300', 'oats': '331'}
-
-    quotes = s.get(url.format(productIds.get(crop)), headers=headers).json().get('quotes')
-    crop_price = pd.DataFrame(quotes)[['expirationDate', 'priorSettle']]
-    crop_price.columns = ['Data', 'Preço']
-    crop_price['Data'] = pd.to_datetime(crop_price['Data'], format='%Y%m%d')
-    crop_price['Preço'] = crop_price['Preço'].str.replace("'", '.').astype(float)
-
-    currency = s.get(url.format(productIds.get('dollar')), headers=headers).json().get('quotes')
-    currency = pd.DataFrame(currency)[['expirationDate', 'priorSettle']]
-    currency.columns = ['Data', 'Taxa']
-    currency['Data'] = pd.to_datetime(currency['Data'], format='%Y%m%d')
-    currency['Taxa'] = 1 / currency['Taxa'].replace('-', None).astype(float)
-
-    crop_price = crop_price.merge(currency, how='inner', on='Data')
-
-    bu2sc = (2.36210 if crop.lower() == 'corn' else 2.20462) if crop.lower() != 'oats' else 4.13365
-
-    crop_price['Preço'] = bu2sc * crop_price['Preço'] * crop_price['Taxa'] / 100
+    crop_price = _to_bag(_crop_curve(s, crop), crop, dollar_curve(session=s))
 
     years = crop_price['Data'].dt.year.to_list()
     months = crop_price['Data'].dt.month.to_list()
@@ -139,3 +169,54 @@ def cbot_commodity_price(crop=None, year=None, month=None):
             crop_price = None
 
     return crop_price
+
+
+def cbot_commodity_prices(crops=('corn', 'soybeans', 'oats'), years=None, months=None, workers=4, fx_ttl=60):
+    """
+    Returns the CBOT futures of several crops in R$ per 60 kg bag, in one
+    DataFrame.
+
+    The dollar futures curve is downloaded once for every crop (and reused for
+    fx_ttl seconds by later calls); the crop curves are downloaded
+    concurrently.
+
+    Parameters
+    ----------
+        crops : tuple | list
+            'corn', 'soybeans' and/or 'oats'.
+        years, months : int | list
+            Keeps only the contracts expiring in these years and months (all
+            if None).
+        workers : int
+            The number of crop curves downloaded at the same time.
+        fx_ttl : float
+            The number of seconds the dollar curve is reused.
+
+    Returns
+    -------
+    pd.DataFrame
+        The Cultura, Data, Preço and Taxa columns, one row per crop and
+        contract.
+    """
+    crops = [crops] if isinstance(crops, str) else list(crops)
+    unknown = [x for x in crops if x not in ['corn', 'soybeans', 'oats']]
+    if unknown:
+        sys.exit("Crop " + ', '.join(unknown) + " was not found. Try 'corn', 'soybeans' or 'oats'.")
+
+    # Each worker thread downloads with its own session
+    with thread_sessions() as session, ThreadPoolExecutor(max_workers=max(min(workers, len(crops) + 1), 1)) as executor:
+        currency = executor.submit(lambda: dollar_curve(fx_ttl, session()))
+        curves = [executor.submit(lambda crop=crop: _crop_curve(session(), crop)) for crop in crops]
+        currency = currency.result()
+        prices = [_to_bag(curve.result(), crop, currency).assign(Cultura=crop) for crop, curve in zip(crops, curves)]
+
+    if not prices:
+        return pd.DataFrame(columns=['Cultura', 'Data', 'Preço', 'Taxa'])
+    prices = pd.concat(prices, ignore_index=True)[['Cultura', 'Data', 'Preço', 'Taxa']]
+
+    if years is not None:
+        prices = prices.loc[prices['Data'].dt.year.isin(np.atleast_1d(years))]
+    if months is not None:
+        prices = prices.loc[prices['Data'].dt.month.isin(np.atleast_1d(months))]
+
+    return prices.reset_index(drop=True)
@@ -0,0 +1,236 @@
+import os
+import time
+import sqlite3
+import argparse
+import pandas as pd
+from os.path import join
+from contextlib import closing
+from cache import CACHE_DIR
+
+
+COLUMNS = ['source', 'instrument', 'horizon', 'price', 'unit', 'recorded_at']
+
+
+def _timestamp(value) -> float:
+
+    # Seconds since the epoch; naive times are taken as UTC, aware ones converted
+    value = pd.Timestamp(value)
+    value = value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+    return value.timestamp()
+
+
+class QuoteHistory:
+    """
+    A local, append-only history of scraped quotes (SQLite).
+
+    Every snapshot recorded from Trading Economics (TEquotes) or CME
+    (my_tools.cbot_commodity_price) is appended with its timestamp, so
+    dashboards read prices locally while scraping runs on a schedule. Old rows
+    can be compacted (repeated prices dropped, old data downsampled).
+
+    Attributes
+    ----------
+    path : str
+        The SQLite file.
+
+    Methods
+    -------
+    append(df: pd.DataFrame, source: str, recorded_at: float) -> int:
+        Appends a long-format snapshot (instrument, horizon, price, unit).
+    record_tequotes(te, crops: list, pairs: list) -> int:
+        Scrapes Trading Economics and appends the quotes.
+    record_cbot(crops: list) -> int:
+        Scrapes the CBOT futures and appends the prices.
+    history(...) -> pd.DataFrame:
+        Returns the quotes recorded in a time range.
+    latest(...) -> pd.DataFrame:
+        Returns the last quote of each instrument and horizon.
+    resample(rule: str, ...) -> pd.DataFrame:
+        Returns the prices on a regular time grid.
+    compact(...) -> dict:
+        Drops repeated prices and downsamples old rows.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.path = join(CACHE_DIR, 'quotes.sqlite') if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(self.__connect()) as con, con:
+            con.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS quotes (source TEXT NOT NULL, instrument TEXT NOT NULL,
+                                                   horizon TEXT NOT NULL, price REAL, unit TEXT,
+                                                   recorded_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS quotes_key_idx ON quotes (instrument, horizon, source, recorded_at);
+                CREATE INDEX IF NOT EXISTS quotes_time_idx ON quotes (recorded_at);
+            """)
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, df: pd.DataFrame, source: str, recorded_at: float = None) -> int:
+        """
+        Appends a snapshot in long format (instrument, horizon, price, unit).
+        recorded_at defaults to df.attrs['fetched_at'] or the current time.
+        Returns the number of rows written.
+        """
+        if df is None or len(df) == 0:
+            return 0
+        recorded_at = recorded_at or df.attrs.get('fetched_at') or time.time()
+        rows = df.reindex(columns=['instrument', 'horizon', 'price', 'unit']).assign(source=source, recorded_at=recorded_at)
+        rows['horizon'] = rows['horizon'].astype(str)
+        with closing(self.__connect()) as con, con:
+            con.executemany('INSERT INTO quotes (source, instrument, horizon, price, unit, recorded_at) VALUES (?, ?, ?, ?, ?, ?)',
+                            rows[COLUMNS].astype(object).where(rows[COLUMNS].notna(), None).itertuples(index=False, name=None))
+        return len(rows)
+
+    def record_tequotes(self, te=None, crops: list = None, pairs: list = None) -> int:
+        """
+        Scrapes the crop (and, when pairs is given, currency) quotes of Trading
+        Economics and appends them. crops=None records every crop.
+        """
+        from tequotes import TEquotes
+
+        te = TEquotes() if te is None else te
+        written = self.append(te.crop_quotes(crops), 'tradingeconomics')
+        if pairs:
+            written += self.append(te.currency_quotes(pairs), 'tradingeconomics')
+        return written
+
+    def record_cbot(self, crops: tuple = ('corn', 'soybeans'), fx_ttl: float = 60) -> int:
+        """
+        Scrapes the CBOT futures (R$/sc) and appends them, one instrument per
+        crop and one horizon (YYYY-MM) per contract. The dollar curve is
+        downloaded once for all the crops and reused for fx_ttl seconds.
+        """
+        from my_tools import cbot_commodity_prices
+
+        df = cbot_commodity_prices(crops, fx_ttl=fx_ttl)
+        df = pd.DataFrame({'instrument': df['Cultura'],
+                           'horizon': df['Data'].dt.strftime('%Y-%m'),
+                           'price': df['Preço'],
+                           'unit': 'R$/sc'})
+        return self.append(df, 'cbot')
+
+    def history(self, instruments: list = None, horizon: str = None, source: str = None,
+                start=None, end=None) -> pd.DataFrame:
+        """
+        Returns the quotes recorded between start and end (anything accepted by
+        pd.Timestamp, in UTC), oldest first.
+
+        Parameters
+        ----------
+            instruments : list
+                The instruments (e.g. ['Soybeans', 'USDBRL']); all if None.
+            horizon : str
+                The horizon ('today', 'Q1/25', '2025-03'...); all if None.
+            source : str
+                'tradingeconomics' or 'cbot'; all if None.
+            start, end : str | datetime
+                The time range.
+        """
+        where, params = [], []
+        if instruments is not None:
+            instruments = [instruments] if isinstance(instruments, str) else list(instruments)
+            where.append(f'instrument IN ({",".join("?" * len(instruments))})')
+            params.extend(instruments)
+        for column, value in (('horizon', horizon), ('source', source)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                params.append(value)
+        if start is not None:
+            where.append('recorded_at >= ?')
+            params.append(_timestamp(start))
+        if end is not None:
+            where.append('recorded_at <= ?')
+            params.append(_timestamp(end))
+
+        sql = 'SELECT * FROM quotes' + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY recorded_at'
+        with closing(self.__connect()) as con:
+            df = pd.read_sql(sql, con, params=params)
+        df['recorded_at'] = pd.to_datetime(df['recorded_at'], unit='s', utc=True)
+        return df
+
+    def latest(self, instruments: list = None, horizon: str = None, source: str = None) -> pd.DataFrame:
+        """Returns the last quote recorded for each source, instrument and horizon."""
+        df = self.history(instruments, horizon, source)
+        return df.groupby(['source', 'instrument', 'horizon'], sort=False).tail(1).reset_index(drop=True)
+
+    def resample(self, rule: str, instruments: list = None, horizon: str = None, source: str = None,
+                 start=None, end=None, how: str = 'last') -> pd.DataFrame:
+        """
+        Returns the prices on a regular time grid (rule as in pandas, e.g.
+        '1h', '1D'), one column per instrument (per instrument and horizon
+        when horizon is None). how is the aggregation of the quotes within
+        each interval ('last', 'mean', 'max'...).
+        """
+        df = self.history(instruments, horizon, source, start, end)
+        columns = ['instrument', 'horizon'] if horizon is None else 'instrument'
+        wide = df.pivot_table(index='recorded_at', columns=columns, values='price', aggfunc='last')
+        return wide.resample(rule).agg(how)
+
+    def compact(self, before=None, rule: str = None, vacuum: bool = True) -> dict:
+        """
+        Compacts the history.
+
+        Runs of repeated prices (the same price in consecutive quotes of the
+        same source, instrument and horizon) are always reduced to their first
+        and last quote, so the history still tells when a price was first and
+        last seen. With rule, rows recorded before the given time are also
+        reduced to the last quote of each interval.
+
+        Returns
+        -------
+        dict
+            The number of rows before and after.
+        """
+        with closing(self.__connect()) as con, con:
+            df = pd.read_sql('SELECT rowid, * FROM quotes ORDER BY recorded_at', con)
+            rows = len(df)
+            key = ['source', 'instrument', 'horizon']
+
+            # A quote is dropped when it repeats the quotes before and after it
+            # (a missing price repeats a missing price)
+            groups = df.groupby(key, sort=False)['price']
+            same = lambda other: df['price'].eq(other) | (df['price'].isna() & other.isna())
+            drop = same(groups.shift(1)) & same(groups.shift(-1))
+            drop &= df.duplicated(key) & df.duplicated(key, keep='last')
+
+            if rule is not None:
+                limit = time.time() if before is None else _timestamp(before)
+                old = df.loc[~drop & (df['recorded_at'] < limit)]
+                bucket = pd.to_datetime(old['recorded_at'], unit='s', utc=True).dt.floor(rule)
+                last = old.groupby(key + [bucket], sort=False).tail(1).index
+                drop |= df.index.isin(old.index.difference(last))
+
+            ids = df.loc[drop, 'rowid'].tolist()
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                con.execute(f'DELETE FROM quotes WHERE rowid IN ({",".join("?" * len(chunk))})', chunk)
+
+        if vacuum:
+            with closing(self.__connect()) as con:
+                con.execute('VACUUM')
+
+        return {'before': rows, 'after': rows - len(ids)}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Records quote snapshots, once or on a schedule.')
+    parser.add_argument('--path', help='the SQLite file')
+    parser.add_argument('--crops', nargs='*', help='Trading Economics crops (all if empty)')
+    parser.add_argument('--pairs', nargs='*', default=[], help='currency pairs, e.g. USDBRL EURUSD')
+    parser.add_argument('--cbot', nargs='*', default=[], help='CBOT crops, e.g. corn soybeans')
+    parser.add_argument('--every', type=float, help='repeats every N seconds')
+    args = parser.parse_args()
+
+    store = QuoteHistory(args.path)
+    pairs = [(x[:3], x[3:]) for x in args.pairs]
+    while True:
+        written = store.record_tequotes(crops=args.crops or None, pairs=pairs)
+        if args.cbot:
+            written += store.record_cbot(args.cbot)
+        print(f'{pd.Timestamp.now()}: {written} quotes recorded.')
+        if not args.every:
+            break
+        time.sleep(args.every)
@@ -1,42 +1,474 @@
 from pytesseract import image_to_string
 from PIL import Image, ImageOps, ImageFilter
+from numpy.lib.stride_tricks import sliding_window_view
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import numpy as np
+import threading
+import argparse
 import re
+import os
 
-class resolve_captcha:
+try:
+    # Keeps a tesseract engine loaded in each thread instead of starting a
+    # tesseract process per call
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
-    def __init__(self, image, thresholds=110, psm=7):
-        self.image = Image.open(image)
-        self.thresholds = thresholds
-        self.psm = psm
 
-    def __prepare_image(self):
-        image = self.image
-        """Transform image to greyscale and blur it"""
-        image = image.filter(ImageFilter.SMOOTH_MORE)
+def smooth(image, passes=2):
+    """Blurs the image with PIL's SMOOTH_MORE kernel (C code, whole image)"""
+    for _ in range(passes):
         image = image.filter(ImageFilter.SMOOTH_MORE)
-        if 'L' != image.mode:
-            image = image.convert('L')
-        return image
+    return image
+
+
+def grayscale(image):
+    """Converts the image to greyscale and returns it as an uint8 array"""
+    if 'L' != image.mode:
+        image = image.convert('L')
+    return np.asarray(image)
+
+
+class threshold:
+    """Binarizes an array (or a stack of arrays): 0 below thresholds, 255 otherwise"""
+
+    def __init__(self, thresholds=110):
+        self.thresholds = thresholds
+
+    def __call__(self, array):
+        return np.where(array < self.thresholds, 0, 255).astype(np.uint8)
+
+
+class morphology:
+    """
+    Binary morphology over the last two axes of an array (or a stack of arrays).
+
+    operation is one of 'erode', 'dilate', 'open' (erode then dilate, removes
+    small specks) and 'close' (dilate then erode, fills small gaps). Erosion
+    and dilation act on the white (255) pixels.
+    """
+
+    def __init__(self, operation='open', size=3):
+        if operation not in ('erode', 'dilate', 'open', 'close'):
+            raise ValueError("operation must be 'erode', 'dilate', 'open' or 'close'.")
+        self.operation = operation
+        self.size = size
+
+    def __window(self, array, reduce):
+        pad = self.size // 2
+        width = [(0, 0)] * (array.ndim - 2) + [(pad, pad), (pad, pad)]
+        windows = sliding_window_view(np.pad(array, width, mode='edge'), (self.size, self.size), axis=(-2, -1))
+        return reduce(windows, axis=(-2, -1))
+
+    def __call__(self, array):
+        steps = {'erode': [np.min], 'dilate': [np.max],
+                 'open': [np.min, np.max], 'close': [np.max, np.min]}
+        for reduce in steps.get(self.operation):
+            array = self.__window(array, reduce)
+        return array
+
+
+class captcha_pipeline:
+    """
+    Prepares captcha images for OCR.
+
+    image_stages run on each PIL image and must end with an uint8 array
+    (grayscale does); array_stages are vectorized NumPy functions that also
+    accept a stack of images. The default stages give the same binarization
+    as the original pixel by pixel implementation.
+    """
+
+    def __init__(self, thresholds=110, image_stages=None, array_stages=None):
+        self.image_stages = [smooth, grayscale] if image_stages is None else image_stages
+        self.array_stages = [threshold(thresholds)] if array_stages is None else array_stages
+
+    @staticmethod
+    def __open(image):
+        return image if isinstance(image, Image.Image) else Image.open(image)
 
-    def __remove_noise(self):
-        image = self.image
-        for column in range(image.size[0]):
-            for line in range(image.size[1]):
-                value = self.__remove_noise_by_pixel(column, line)
-                image.putpixel((column, line), value)
+    def __to_array(self, image):
+        image = self.__open(image)
+        for stage in self.image_stages:
+            image = stage(image)
         return image
 
-    def __remove_noise_by_pixel(self, column, line):
-        image, thresholds = self.image, self.thresholds
-        if image.getpixel((column, line)) < thresholds:
-            return (0)
-        return (255)
+    def __apply(self, array):
+        for stage in self.array_stages:
+            array = stage(array)
+        return array
+
+    def __call__(self, image):
+        """Returns the binarized image as an uint8 array"""
+        return self.__apply(self.__to_array(image))
+
+    def batch(self, images):
+        """
+        Prepares many images at once. Images of the same size are stacked, so
+        every array stage runs once over the whole batch.
+
+        Returns a list of uint8 arrays in the order of images.
+        """
+        arrays = [self.__to_array(image) for image in images]
+        out = [None] * len(arrays)
+
+        shapes = {}
+        for i, array in enumerate(arrays):
+            shapes.setdefault(array.shape, []).append(i)
+
+        for shape, positions in shapes.items():
+            stack = self.__apply(np.stack([arrays[i] for i in positions]))
+            for i, array in zip(positions, stack):
+                out[i] = array
+
+        return out
+
+
+class resolve_captcha:
+
+    def __init__(self, image, thresholds=110, psm=7):
+        self.image = Image.open(image) if not isinstance(image, Image.Image) else image
+        self.thresholds = thresholds
+        self.psm = psm
+
+    def binarize(self):
+        """Transform image to greyscale, blur it and remove the noise"""
+        return Image.fromarray(captcha_pipeline(self.thresholds)(self.image))
 
     def text_from_captcha(self):
-        self.image = self.__prepare_image()
-        image = self.__remove_noise()
+        image = self.binarize()
         lang = 'eng'
         config = '--oem 1 --psm {} -c page_separator='.format(self.psm)
         captcha = image_to_string(image, lang=lang, config=config)
-        captcha = re.sub('\W+', '', captcha.replace('\n',''))
+        captcha = re.sub(r'\W+', '', captcha.replace('\n',''))
         return captcha
+
+
+_fallback_warned = False
+
+
+def _warn_fallback():
+
+    global _fallback_warned
+    if tesserocr is None and not _fallback_warned:
+        _fallback_warned = True
+        print('Warning: tesserocr is not installed; each OCR read starts a tesseract process. '
+              'Install tesserocr to keep the engines loaded.')
+
+
+class ocr_pool:
+    """
+    A long-lived pool of OCR workers that reads each captcha with several
+    threshold and page segmentation (psm) variants in parallel and returns the
+    most voted answer.
+
+    With tesserocr installed (pip install tesserocr, an optional dependency)
+    each worker thread keeps its own tesseract engine loaded, so there is no
+    process startup per read. Without it the pool falls back to pytesseract,
+    which starts one tesseract process per variant: every captcha then costs
+    len(thresholds) * len(psms) process startups (tens of milliseconds each)
+    and the pool only saves the preprocessing and runs the reads in parallel.
+    The pool is meant to be created once and shared (see get_pool).
+
+    Attributes
+    ----------
+    thresholds : tuple
+        The binarization thresholds tried on each image.
+    psms : tuple
+        The tesseract page segmentation modes tried on each image.
+    workers : int
+        The number of OCR threads.
+    """
+
+    def __init__(self, thresholds=(90, 110, 130), psms=(7, 8), workers=4, lang='eng'):
+        self.thresholds = tuple(np.atleast_1d(thresholds).tolist())
+        self.psms = tuple(np.atleast_1d(psms).tolist())
+        self.workers = workers
+        self.lang = lang
+        self.__prepare = captcha_pipeline(array_stages=[])
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr')
+        self.__local = threading.local()
+        self.__engines = []
+        self.__lock = threading.Lock()
+        _warn_fallback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+        for engine in self.__engines:
+            engine.End()
+        self.__engines = []
+
+    def __engine(self):
+        engine = getattr(self.__local, 'engine', None)
+        if engine is None:
+            engine = tesserocr.PyTessBaseAPI(lang=self.lang, oem=tesserocr.OEM.LSTM_ONLY)
+            self.__local.engine = engine
+            with self.__lock:
+                self.__engines.append(engine)
+        return engine
+
+    def __read(self, image, psm):
+        if tesserocr is not None:
+            engine = self.__engine()
+            engine.SetPageSegMode(psm)
+            engine.SetImage(image)
+            text = engine.GetUTF8Text()
+        else:
+            config = '--oem 1 --psm {} -c page_separator='.format(psm)
+            text = image_to_string(image, lang=self.lang, config=config)
+        return re.sub(r'\W+', '', text.replace('\n', ''))
+
+    @staticmethod
+    def vote(answers):
+        """
+        Returns the most common non-empty answer and the share of the variants
+        that agree with it (0 when nothing was read).
+        """
+        counts = Counter(x for x in answers if x)
+        if not counts:
+            return '', 0.0
+        text, votes = counts.most_common(1)[0]
+        return text, votes / len(answers)
+
+    def submit(self, image):
+        """
+        Binarizes the image with every threshold and submits one read per
+        (threshold, psm) variant. Returns the list of futures.
+        """
+        gray = self.__prepare(image)
+        binary = np.where(gray[None] < np.array(self.thresholds)[:, None, None], 0, 255).astype(np.uint8)
+        variants = [Image.fromarray(x) for x in binary]
+        return [self.__executor.submit(self.__read, x, psm) for x in variants for psm in self.psms]
+
+    def solve(self, image):
+        """
+        Reads a captcha.
+
+        Parameters
+        ----------
+            image : str | file | PIL.Image.Image
+                The captcha image.
+
+        Returns
+        -------
+        tuple
+            The consensus text and its confidence (0 to 1).
+        """
+        return self.vote([x.result() for x in self.submit(image)])
+
+    def solve_many(self, images):
+        """Reads many captchas, keeping every worker busy. Returns a list of (text, confidence)."""
+        futures = [self.submit(image) for image in images]
+        return [self.vote([x.result() for x in f]) for f in futures]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(thresholds=(90, 110, 130), psms=(7, 8), workers=4, lang='eng'):
+    """Returns the process-wide ocr_pool for these settings, creating it on the first call"""
+    key = (tuple(np.atleast_1d(thresholds).tolist()), tuple(np.atleast_1d(psms).tolist()), workers, lang)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ocr_pool(*key)
+        return _pools[key]
+
+
+class captcha_classifier:
+    """
+    A small k-NN character classifier for fixed-font captchas, in pure NumPy.
+
+    Each captcha is binarized, split into characters by the ink column profile
+    and every character is scaled to a size x size template. Reading a captcha
+    is a single matrix product between its characters and the training
+    templates (cosine similarity), so it needs no OCR engine.
+
+    Attributes
+    ----------
+    length : int
+        The number of characters of a captcha (learned from the labels).
+    size : int
+        The side of the character templates, in pixels.
+    k : int
+        The number of neighbours that vote for each character.
+    templates : np.ndarray
+        The training templates (n, size * size), normalized to unit length.
+    labels : np.ndarray
+        The character of each template.
+
+    Methods
+    -------
+    fit(images: list, labels: list) -> captcha_classifier:
+        Learns the templates from labeled captchas.
+    solve(image) -> tuple:
+        Returns the text of a captcha and its confidence.
+    save(path: str) / load(path: str):
+        Stores the model as a .npz file.
+    """
+
+    def __init__(self, thresholds=110, size=16, k=3, length=None, min_ink=2):
+        self.thresholds = thresholds
+        self.size = size
+        self.k = k
+        self.length = length
+        self.min_ink = min_ink
+        self.templates = None
+        self.labels = None
+        # Smoothing a single channel is three times cheaper than smoothing RGB
+        self.__prepare = captcha_pipeline(thresholds, image_stages=[self.__gray, smooth, np.asarray])
+
+    @staticmethod
+    def __gray(image):
+        return image.convert('L') if 'L' != image.mode else image
+
+    def __runs(self, ink):
+        columns = np.concatenate([[False], ink.sum(axis=0) >= self.min_ink, [False]])
+        edges = np.flatnonzero(np.diff(columns.astype(np.int8)))
+        return [list(x) for x in edges.reshape(-1, 2)]
+
+    def segment(self, image):
+        """
+        Splits a captcha into its characters. Returns a list of boolean ink
+        arrays, one per character. With a known length, touching characters
+        are split at the middle of the widest segment and fragments are merged
+        across the narrowest gap.
+        """
+        ink = self.__prepare(image) == 0
+        runs = self.__runs(ink)
+
+        if self.length:
+            while len(runs) > self.length:
+                gaps = [runs[i + 1][0] - runs[i][1] for i in range(len(runs) - 1)]
+                i = int(np.argmin(gaps))
+                runs[i:i + 2] = [[runs[i][0], runs[i + 1][1]]]
+            while 0 < len(runs) < self.length:
+                widths = [b - a for a, b in runs]
+                i = int(np.argmax(widths))
+                if widths[i] < 2:
+                    # Nothing left to split: the answer will be short and rejected
+                    break
+                a, b = runs[i]
+                middle = (a + b) // 2
+                runs[i:i + 1] = [[a, middle], [middle, b]]
+
+        chars = []
+        for a, b in runs:
+            if b <= a:
+                continue
+            char = ink[:, a:b]
+            rows = np.flatnonzero(char.any(axis=1))
+            chars.append(char[rows[0]:rows[-1] + 1] if len(rows) > 0 else char)
+        return chars
+
+    def features(self, image):
+        """Returns the normalized templates (n_chars, size * size) of a captcha"""
+        chars = self.segment(image)
+        out = np.zeros((len(chars), self.size * self.size), dtype=np.float32)
+        for i, char in enumerate(chars):
+            scaled = Image.fromarray(char.astype(np.uint8) * 255).resize((self.size, self.size), Image.BILINEAR)
+            out[i] = np.asarray(scaled, dtype=np.float32).ravel()
+        norm = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norm > 0, norm, 1)
+
+    def fit(self, images, labels):
+        """
+        Learns the templates from labeled captchas. Captchas whose number of
+        segments differs from the length of their label are skipped.
+        """
+        if self.length is None:
+            self.length = Counter(len(x) for x in labels).most_common(1)[0][0]
+
+        templates, chars = [], []
+        for image, label in zip(images, labels):
+            x = self.features(image)
+            if len(x) == len(label):
+                templates.append(x)
+                chars.extend(label)
+
+        self.templates = np.concatenate(templates)
+        self.labels = np.array(chars)
+        return self
+
+    def solve(self, image):
+        """
+        Reads a captcha.
+
+        Returns
+        -------
+        tuple
+            The text and its confidence (0 to 1): the smallest share of
+            neighbours that agree on a character.
+        """
+        if self.templates is None:
+            raise ValueError('The classifier has not been trained (see fit or load).')
+
+        x = self.features(image)
+        if len(x) == 0:
+            return '', 0.0
+
+        k = min(self.k, len(self.templates))
+        similarity = x @ self.templates.T
+        nearest = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+
+        classes, codes = np.unique(self.labels, return_inverse=True)
+        votes = np.zeros((len(x), len(classes)), dtype=np.int64)
+        np.add.at(votes, (np.arange(len(x))[:, None], codes[nearest]), 1)
+
+        text = ''.join(classes[votes.argmax(axis=1)])
+        return text, float(votes.max(axis=1).min() / k)
+
+    def solve_many(self, images):
+        return [self.solve(image) for image in images]
+
+    def save(self, path):
+        np.savez_compressed(path, templates=self.templates, labels=self.labels,
+                            params=np.array([self.thresholds, self.size, self.k, self.length, self.min_ink]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            thresholds, size, k, length, min_ink = data['params'].tolist()
+            model = cls(thresholds, size, k, length, min_ink)
+            model.templates = data['templates']
+            model.labels = data['labels']
+        return model
+
+
+def load_corpus(path):
+    """
+    Reads a folder of labeled captchas, named <label>.png or <label>_<n>.png.
+    Returns the images and their labels.
+    """
+    images, labels = [], []
+    for name in sorted(os.listdir(path)):
+        label, extension = os.path.splitext(name)
+        if extension.lower() not in ('.png', '.jpg', '.jpeg', '.gif', '.bmp'):
+            continue
+        images.append(Image.open(os.path.join(path, name)).convert('RGB'))
+        labels.append(label.split('_')[0])
+    return images, labels
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Trains the captcha classifier from a folder of labeled captchas.')
+    parser.add_argument('command', choices=['train'])
+    parser.add_argument('corpus', help='folder with <label>.png files')
+    parser.add_argument('model', help='output .npz file')
+    parser.add_argument('--thresholds', type=int, default=110)
+    parser.add_argument('--size', type=int, default=16)
+    parser.add_argument('-k', type=int, default=3)
+    args = parser.parse_args()
+
+    images, labels = load_corpus(args.corpus)
+    model = captcha_classifier(args.thresholds, args.size, args.k).fit(images, labels)
+    model.save(args.model)
+    print(f'{len(model.labels)} characters from {len(images)} captchas saved to {args.model}')
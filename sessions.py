@@ -0,0 +1,54 @@
+import threading
+import requests
+from contextlib import contextmanager
+
+
+@contextmanager
+def thread_sessions(template: requests.Session = None, factory=requests.Session):
+    """
+    Gives every worker thread of a pool its own session.
+
+    requests.Session is not thread-safe (its cookie jar and connection pool are
+    shared without locks), so sessions are never shared between threads. Each
+    thread gets a new session from factory on its first request, with the
+    headers, cookies, certificate check, proxies and authentication of
+    template. All of them are closed when the block exits.
+
+    Example:
+
+        with thread_sessions(s) as session, ThreadPoolExecutor() as executor:
+            pages = list(executor.map(lambda url: session().get(url), urls))
+
+    Parameters
+    ----------
+        template : requests.Session
+            The session whose settings are copied (none if None).
+        factory : callable
+            Creates a new session.
+
+    Yields
+    ------
+    callable
+        Returns the session of the calling thread.
+    """
+    local, sessions, lock = threading.local(), [], threading.Lock()
+
+    def session():
+        s = getattr(local, 'session', None)
+        if s is None:
+            s = local.session = factory()
+            if template is not None:
+                s.headers.update(template.headers)
+                s.cookies.update(template.cookies)
+                s.verify = template.verify
+                s.proxies.update(template.proxies)
+                s.auth = template.auth
+            with lock:
+                sessions.append(s)
+        return s
+
+    try:
+        yield session
+    finally:
+        for s in sessions:
+            s.close()
@@ -1,116 +1,262 @@
-from requests import Session
-from bs4 import BeautifulSoup as bs
+from requests import Session, Timeout
+from bs4 import BeautifulSoup as bs, SoupStrainer
 import urllib3
+import time
+import threading
 import numpy as np
 import pandas as pd
 from io import BytesIO
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor
+from cache import SnapshotCache, CACHE_DIR
+from sessions import thread_sessions
 from document import check_document
-from resolve_captcha import resolve_captcha
+from resolve_captcha import get_pool
 
 urllib3.disable_warnings()
 
+BASE_URL = 'https://sigef.incra.gov.br'
+SEARCH_URL = BASE_URL + '/consultar/parcelas/'
+CAPTCHA_URL = BASE_URL + '/captcha/image/'
+REFRESH_URL = BASE_URL + '/captcha/refresh/'
+
+HEADERS = {'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
+           'Accept-Encoding': 'gzip, deflate, br',
+           'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+           'Connection': 'keep-alive',
+           'Upgrade-Insecure-Requests': '1',
+           'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
+
+
+# Detail pages rarely change; they are kept for a week. The cache is created
+# on first use; assign sigef.PARCEL_CACHE to use another directory or TTL
+PARCEL_CACHE = None
+
+
+def _parcel_cache():
+
+    global PARCEL_CACHE
+    if PARCEL_CACHE is None:
+        PARCEL_CACHE = SnapshotCache(join(CACHE_DIR, 'sigef'), ttl=7 * 86400)
+    return PARCEL_CACHE
+
+
+class CaptchaError(RuntimeError):
+    """Raised when the captcha is not solved within max_attempts or deadline"""
+
+
+def new_session():
+
+    s = Session()
+    s.headers.update(HEADERS)
+    s.verify = False
+    return s
+
+
 class sigef:
 
-    def __init__(self, cpf, thresholds=110):
+    def __init__(self, cpf, thresholds=(90, 110, 130), psms=(7, 8), solver=None, session=None,
+                 max_attempts=20, deadline=120, backoff=0.5, max_backoff=8, min_confidence=0, timeout=30,
+                 verbose=True):
         self.cpf = check_document(cpf).formatted_document
         self.thresholds = thresholds
+        # Any object with a solve(image) -> (text, confidence) method, e.g. a
+        # trained resolve_captcha.captcha_classifier
+        self.ocr = get_pool(thresholds, psms) if solver is None else solver
+        # The session (and its connection) is kept for every attempt and query
+        self.session = new_session() if session is None else session
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Answers below this confidence are not submitted; a new captcha is requested instead
+        self.min_confidence = min_confidence
+        # Every request is limited to timeout seconds, and to what is left of
+        # the deadline while solving the captcha
+        self.timeout = timeout
+        self.verbose = verbose
+        self.stats = {'queries': 0, 'solved': 0, 'attempts': 0, 'skipped': 0, 'ocr_time': 0.0, 'network_time': 0.0}
+        self.__stats_lock = threading.Lock()
+        self.__expires = None
 
-    def consultar_sigef(self):
+    def __log(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
 
-        error = True
+    def __count(self, key, value=1):
+        with self.__stats_lock:
+            self.stats[key] += value
 
-        attempt = 0
-        print('Trying to solve captcha...')
-        while(error != False):
+    def __timeout(self):
+        if self.__expires is None:
+            return self.timeout
+        return max(0.1, min(self.timeout, self.__expires - time.monotonic()))
 
-            attempt += 1
-            print('  -- Attempt {0:02d}'.format(attempt), end='\r')
+    def __get(self, url, session=None, **kwargs):
 
-            url = 'https://sigef.incra.gov.br/consultar/parcelas/'
+        start = time.perf_counter()
+        try:
+            req = (self.session if session is None else session).get(url, timeout=self.__timeout(), **kwargs)
+            req.raise_for_status()
+        finally:
+            self.__count('network_time', time.perf_counter() - start)
+        return req
 
-            s = Session()
+    @staticmethod
+    def __form(soup):
+        return {i['name']: i.get('value', '') for i in soup.select('input') if i.has_attr('name')}
 
-            headers = {'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-                       'Accept-Encoding': 'gzip, deflate, br',
-                       'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-                       'Connection': 'keep-alive',
-                       'Upgrade-Insecure-Requests': '1',
-                       'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/103.0.0.0 Safari/537.36'}
+    def __refresh_captcha(self, soup=None):
 
-            payload = {'pesquisa_avancada': 'True',
-                       'cpf_cnpj': self.cpf}
+        # A wrong answer returns the form again with a new captcha; otherwise
+        # ask django-simple-captcha for a new one
+        form = self.__form(soup) if soup is not None else {}
+        if form.get('captcha_0'):
+            return form
+        key = self.__get(REFRESH_URL, headers={'X-Requested-With': 'XMLHttpRequest'}).json().get('key')
+        form = dict(self.__inputs)
+        form.update({'captcha_0': key})
+        return form
 
-            s.headers = headers
-            s.params = payload
-            s.verify = False
+    def statistics(self):
+        """
+        Returns the captcha statistics of this object: attempts per solved
+        captcha, the share of attempts that solved it, and the time spent in
+        OCR and in network requests.
+        """
+        with self.__stats_lock:
+            stats = dict(self.stats)
+        stats['attempts_per_solve'] = stats['attempts'] / stats['solved'] if stats['solved'] else None
+        stats['solve_rate'] = stats['solved'] / stats['attempts'] if stats['attempts'] else None
+        return stats
 
-            req = s.get(url)
+    def solve_captcha(self):
+        """
+        Opens the search form and submits it until the captcha is accepted.
+        Only the captcha image is fetched again between attempts, over the
+        same session, with an exponential backoff after each failure.
 
-            cookies = req.cookies
-            soup = bs(req.text, 'html.parser')
-            inputs = soup.select('input')
-            d_inputs = {i['name']: i.get('value', '') for i in inputs}
+        Returns the BeautifulSoup of the result page. Raises CaptchaError
+        after max_attempts or when deadline (s) is exceeded.
+        """
+        started = time.monotonic()
+        self.__expires = started + self.deadline
+        self.__count('queries')
+        try:
+            return self.__solve(started)
+        except Timeout as e:
+            if time.monotonic() >= self.__expires - 0.1:
+                raise CaptchaError(f'Captcha not solved within the deadline ({self.deadline} s).') from e
+            raise
+        finally:
+            self.__expires = None
 
-            s.params = d_inputs
-            s.cookies = cookies
+    def __solve(self, started):
 
-            url_captcha = 'https://sigef.incra.gov.br/captcha/image/'
-            img = s.get(url_captcha + d_inputs.get('captcha_0')).content
-            img = BytesIO(img)
+        soup = bs(self.__get(SEARCH_URL, params={'pesquisa_avancada': 'True', 'cpf_cnpj': self.cpf}).text, 'html.parser')
+        self.__inputs = self.__form(soup)
+        form = dict(self.__inputs)
 
-            captcha = resolve_captcha(img, self.thresholds)
-            captcha = captcha.text_from_captcha()
+        self.__log('Trying to solve captcha...')
+        for attempt in range(1, self.max_attempts + 1):
 
-            d_inputs.update({'captcha_1': captcha})
-            s.params = d_inputs
+            self.__log('  -- Attempt {0:02d}'.format(attempt), end='\r')
+            self.__count('attempts')
 
-            url = s.get(url).url
-            out = s.get(url)
+            img = BytesIO(self.__get(CAPTCHA_URL + form.get('captcha_0')).content)
 
-            soup = bs(out.text, 'html.parser')
+            start = time.perf_counter()
+            captcha, confidence = self.ocr.solve(img)
+            self.__count('ocr_time', time.perf_counter() - start)
 
-            try:
-                error = soup.find_all('p', {'class': 'help-block error'})[0].get_text()
-            except:
-                print('\nCaptcha solved!')
-                error = False
+            if captcha and confidence >= self.min_confidence:
+                form.update({'captcha_1': captcha})
+                soup = bs(self.__get(SEARCH_URL, params=form).text, 'html.parser')
+                if not soup.find_all('p', {'class': 'help-block error'}):
+                    self.__log('\nCaptcha solved!')
+                    self.__count('solved')
+                    return soup
+                answer = soup
+            else:
+                self.__count('skipped')
+                answer = None
+
+            wait = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+            if attempt == self.max_attempts or time.monotonic() - started + wait >= self.deadline:
                 break
+            time.sleep(wait)
 
-        tables = []
+            form = self.__refresh_captcha(answer)
+            form.pop('captcha_1', None)
 
-        try:
+        raise CaptchaError(f'Captcha not solved after {attempt} attempts ({time.monotonic() - started:.1f} s).')
+
+    def consultar_sigef(self, workers=8, cache=True):
+        """
+        Returns one row per parcel linked to the document (None when there is
+        none). Detail pages are fetched concurrently, each worker thread with
+        its own session (sharing the cookies of the search), and cached by
+        parcel code, so repeated queries skip them.
+        """
+        soup = self.solve_captcha()
+
+        if soup.find_all('div', {'class': 'alert alert-info alert-block'}):
+            self.__log('There were no glebes linked to the CPF.')
+            return None
+
+        self.__log('Writting the table...')
+        codes = list(dict.fromkeys(x['href'] for x in soup.find_all('a', {'title': 'Visualizar detalhes...'})))
+
+        with thread_sessions(self.session, new_session) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(lambda href: self.parcel_detail(href, cache, session()), codes))
+
+        return pd.DataFrame(rows, index=['P{:03d}'.format(i + 1) for i in range(len(rows))])
+
+    def parcel_detail(self, href, cache=True, session=None):
+        """
+        Returns the fields of a parcel detail page (href as linked in the
+        search results). session defaults to the session of the search.
+        """
+        code = href.strip('/').split('/')[-1]
+        session = self.session if session is None else session
+        if cache:
+            # A page is cached only once it has been parsed, so an error page
+            # is never served from the cache
+            parsed = []
+            start = time.perf_counter()
+            try:
+                content = _parcel_cache().fetch('parcela_' + code + '.html', BASE_URL + href, session=session,
+                                                timeout=self.__timeout(),
+                                                validate=lambda data: parsed.append(parse_parcel(data)))
+            finally:
+                self.__count('network_time', time.perf_counter() - start)
+            return parsed[0] if parsed else parse_parcel(content)
+        content = self.__get(BASE_URL + href, session=session).content
+        return parse_parcel(content)
 
-            error = soup.find_all('div', {'class': 'alert alert-info alert-block'})[0].get_text()
-            print('There were no glebes linked to the CPF.')
-            table = None
 
-        except:
+def _table_rows(table):
+    return [[c.get_text(' ', strip=True) for c in tr.find_all(['th', 'td'])] for tr in table.find_all('tr')]
 
-            print('Writting the table...')
-            codes = list(set(map(lambda x: x['href'], soup.find_all('a', {'title': 'Visualizar detalhes...'}))))
 
-            for c in codes:
-                data = pd.read_html(s.get('https://sigef.incra.gov.br' + c).content, encoding='utf_8')
-                id = 'P{:03d}'.format(codes.index(c + 1))
-                dum0 = data[4]
-                dum1 = data[0]
-                dum2 = data[3].iloc[:5,]
-                dum3 = data[5]
-                dum0 = pd.DataFrame({id: dum0.iloc[0].values}, index=dum0.columns.values)
-                dum1 = pd.DataFrame({id: dum1[1].values}, index=dum1[0].values)
-                dum2 = pd.DataFrame({id: dum2[1].values}, index=dum2[0].values)
-                dum3 = pd.DataFrame({id: dum3[1].values}, index=dum3[0].values)
-                dum1.replace('Situação', 'Situação da Certificação', inplace=True)
-                dum2.replace('Situação', 'Situação do Registro', inplace=True)
-                dum2.replace('Denominação', 'Nome da fazenda', inplace=True)
-                out = pd.concat([dum0, dum1, dum2, dum3], axis=0)
-                tables.append(out)
+def _pairs(rows, rename=None):
+    rename = {} if rename is None else rename
+    return {rename.get(x[0], x[0]): x[1] for x in rows if len(x) >= 2}
 
-            table = pd.concat(tables, axis=1).T
 
-        return table
+def parse_parcel(content):
+    """
+    Extracts the fields of a parcel detail page into a dict: the header of the
+    area table (table 4), the certification (table 0), the first five lines of
+    the registry (table 3) and the technical data (table 5). Only the tables
+    are parsed and values are kept as text.
+    """
+    tables = bs(content, 'lxml', parse_only=SoupStrainer('table')).find_all('table')
 
-        print('Done!')
+    area = _table_rows(tables[4])
+    row = dict(zip(area[0], area[1]))
+    row.update(_pairs(_table_rows(tables[0]), {'Situação': 'Situação da Certificação'}))
+    row.update(_pairs(_table_rows(tables[3])[:5], {'Situação': 'Situação do Registro', 'Denominação': 'Nome da fazenda'}))
+    row.update(_pairs(_table_rows(tables[5])))
 
-teste = sigef(cpf='078.489.099-48')
-teste.consultar_sigef()
+    return row
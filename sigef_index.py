@@ -0,0 +1,179 @@
+import os
+import glob
+import shapely
+import numpy as np
+import pandas as pd
+from shapely import STRtree
+from geoparquet import read_snapshot
+
+
+class SigefParcelIndex:
+    """
+    A spatial index over the certified SIGEF parcels downloaded by get_sigef,
+    for batch point-in-polygon and bbox queries.
+
+    Each state is stored in its own folder (path/PA/...) as raw WKB with its
+    offsets and bounds as .npy files and the attributes as Parquet. Loading
+    memory-maps the arrays and builds an STRtree over the parcel boxes only;
+    a polygon is decoded (and prepared) the first time a query reaches it.
+
+    Attributes
+    ----------
+    ufs : list
+        The states loaded.
+    bounds : np.ndarray
+        (minx, miny, maxx, maxy) of every parcel, state after state.
+    tree : shapely.STRtree
+        The spatial index over the parcel boxes.
+
+    Methods
+    -------
+    build(dataset: str, path: str, ufs: list) -> SigefParcelIndex:
+        Writes the index of a get_sigef dataset and loads it.
+    load(path: str, ufs: list) -> SigefParcelIndex:
+        Loads an index written by build().
+    contains(x, y) -> pd.DataFrame:
+        Returns the parcel that contains each point.
+    query_bbox(bboxes, exact: bool) -> pd.DataFrame:
+        Returns the parcels that intersect each bbox.
+    """
+
+    CRS = 'EPSG:4326'
+
+    def __init__(self, path: str, ufs: list) -> None:
+        self.path = path
+        self.ufs = list(ufs)
+        self.__wkb = [np.load(os.path.join(path, uf, 'wkb.npy'), mmap_mode='r') for uf in self.ufs]
+        self.__offsets = [np.load(os.path.join(path, uf, 'offsets.npy'), mmap_mode='r') for uf in self.ufs]
+        parts = [np.load(os.path.join(path, uf, 'bounds.npy'), mmap_mode='r') for uf in self.ufs]
+
+        self.__starts = np.cumsum([0] + [len(x) for x in parts])
+        self.bounds = np.concatenate(parts) if parts else np.empty((0, 4))
+        self.tree = STRtree(shapely.box(*self.bounds.T))
+
+        self.__geometries = np.empty(len(self.bounds), dtype=object)
+        self.__decoded = np.zeros(len(self.bounds), dtype=bool)
+        self.__attributes = {}
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    @classmethod
+    def build(cls, dataset: str, path: str, ufs: list = None) -> 'SigefParcelIndex':
+        """
+        Writes the index of the states of a get_sigef dataset.
+
+        Parameters
+        ----------
+            dataset : str
+                The GeoParquet dataset written by get_sigef (path/uf=PA/...).
+            path : str
+                The index folder.
+            ufs : list
+                The states to index (every state of the dataset if None).
+        """
+        if ufs is None:
+            ufs = sorted(os.path.basename(x).split('=')[1] for x in glob.glob(os.path.join(dataset, 'uf=*')))
+        ufs = [x.upper() for x in ufs]
+
+        for uf in ufs:
+            gdf = read_snapshot(os.path.join(dataset, 'uf=' + uf)).to_crs(cls.CRS)
+            gdf = gdf.loc[gdf.geometry.notna() & ~gdf.geometry.is_empty].reset_index(drop=True)
+
+            wkb = shapely.to_wkb(gdf.geometry.values)
+            offsets = np.concatenate([[0], np.cumsum([len(x) for x in wkb])]).astype(np.int64)
+
+            folder = os.path.join(path, uf)
+            os.makedirs(folder, exist_ok=True)
+            np.save(os.path.join(folder, 'wkb.npy'), np.frombuffer(b''.join(wkb), dtype=np.uint8))
+            np.save(os.path.join(folder, 'offsets.npy'), offsets)
+            np.save(os.path.join(folder, 'bounds.npy'), shapely.bounds(gdf.geometry.values))
+            pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).to_parquet(os.path.join(folder, 'attributes.parquet'), index=False)
+
+        return cls.load(path, ufs)
+
+    @classmethod
+    def load(cls, path: str, ufs: list = None) -> 'SigefParcelIndex':
+        """Loads the index of some (or all) states."""
+        if ufs is None:
+            ufs = sorted(x for x in os.listdir(path) if os.path.exists(os.path.join(path, x, 'bounds.npy')))
+        return cls(path, [x.upper() for x in ufs])
+
+    def __locate(self, rows):
+        part = np.searchsorted(self.__starts, rows, side='right') - 1
+        return part, rows - self.__starts[part]
+
+    def geometries(self, rows: np.ndarray) -> np.ndarray:
+        """Returns the (prepared) polygons of the given rows, decoding them on first use."""
+        rows = np.asarray(rows, dtype=np.int64)
+        missing = np.unique(rows[~self.__decoded[rows]])
+        if len(missing) > 0:
+            part, local = self.__locate(missing)
+            wkb = [self.__wkb[p][self.__offsets[p][i]:self.__offsets[p][i + 1]].tobytes() for p, i in zip(part, local)]
+            geoms = shapely.from_wkb(wkb)
+            shapely.prepare(geoms)
+            self.__geometries[missing] = geoms
+            self.__decoded[missing] = True
+        return self.__geometries[rows]
+
+    def attributes(self, rows: np.ndarray) -> pd.DataFrame:
+        """Returns the attributes (parcel code, name...) of the given rows, with their uf."""
+        rows = np.asarray(rows, dtype=np.int64)
+        part, local = self.__locate(rows)
+        out = []
+        for p in np.unique(part):
+            uf = self.ufs[p]
+            if uf not in self.__attributes:
+                self.__attributes[uf] = pd.read_parquet(os.path.join(self.path, uf, 'attributes.parquet'))
+            mask = part == p
+            chunk = self.__attributes[uf].iloc[local[mask]].copy()
+            chunk.insert(0, 'uf', uf)
+            chunk.index = np.flatnonzero(mask)
+            out.append(chunk)
+        if not out:
+            return pd.DataFrame(columns=['uf'])
+        return pd.concat(out).sort_index()
+
+    def __result(self, query, rows, name):
+        out = self.attributes(rows).reset_index(drop=True)
+        out.insert(0, name, query)
+        return out
+
+    def contains(self, x, y) -> pd.DataFrame:
+        """
+        Returns one row per (point, parcel) pair where the parcel contains the
+        point (lon/lat, EPSG:4326), with the attributes of the parcel.
+
+        Parameters
+        ----------
+            x, y : array-like
+                The coordinates of the points.
+
+        Returns
+        -------
+        pd.DataFrame
+            The position of the point, the uf and the attributes of the parcel.
+        """
+        x, y = np.atleast_1d(np.asarray(x, dtype=float)), np.atleast_1d(np.asarray(y, dtype=float))
+        points, rows = self.tree.query(shapely.points(x, y), predicate='intersects')
+        inside = shapely.contains_xy(self.geometries(rows), x[points], y[points])
+        return self.__result(points[inside], rows[inside], 'ponto')
+
+    def query_bbox(self, bboxes, exact: bool = True) -> pd.DataFrame:
+        """
+        Returns one row per (bbox, parcel) pair where the parcel falls in the bbox.
+
+        Parameters
+        ----------
+            bboxes : array-like
+                One (minx, miny, maxx, maxy) or an (n, 4) array.
+            exact : bool
+                Checks the polygons; otherwise only the parcel boxes are compared.
+        """
+        bboxes = np.atleast_2d(np.asarray(bboxes, dtype=float))
+        boxes = shapely.box(*bboxes.T)
+        query, rows = self.tree.query(boxes, predicate='intersects')
+        if exact and len(rows) > 0:
+            keep = shapely.intersects(self.geometries(rows), boxes[query])
+            query, rows = query[keep], rows[keep]
+        return self.__result(query, rows, 'bbox')
@@ -0,0 +1,191 @@
+import json
+import time
+import queue
+import sqlite3
+import threading
+import pandas as pd
+from document import check_documents
+from resolve_captcha import ocr_pool
+from sigef import sigef, new_session
+
+
+class SigefRunner:
+    """
+    Looks up many CPF/CNPJ in SIGEF with a pool of workers, keeping every
+    result in a local SQLite file.
+
+    Each worker thread owns its HTTP session and its captcha solver. Every
+    lookup is committed as soon as it finishes, so an interrupted run started
+    again with the same store only processes the documents still pending.
+
+    Attributes
+    ----------
+    store : str
+        The SQLite file with the jobs and their results.
+    workers : int
+        The number of concurrent lookups.
+    solver_factory : callable
+        Returns a new captcha solver (an object with solve(image) -> (text,
+        confidence)) for each worker. Defaults to a single-threaded ocr_pool.
+    options : dict
+        Extra arguments for sigef (max_attempts, deadline, backoff...).
+
+    Methods
+    -------
+    run(documents: list, retry_failed: bool) -> dict:
+        Looks up the documents not done yet and returns the run report.
+    results() -> pd.DataFrame:
+        Returns one row per parcel found so far.
+    jobs() -> pd.DataFrame:
+        Returns the status and timings of every lookup.
+    """
+
+    def __init__(self, store: str = 'sigef_jobs.sqlite', workers: int = 4, solver_factory=None,
+                 verbose: bool = True, **options) -> None:
+        self.store = store
+        self.workers = workers
+        self.solver_factory = (lambda: ocr_pool(workers=1)) if solver_factory is None else solver_factory
+        self.verbose = verbose
+        self.options = options
+        self.__lock = threading.Lock()
+        self.__con = sqlite3.connect(store, check_same_thread=False)
+        self.__con.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (documento TEXT PRIMARY KEY, status TEXT NOT NULL,
+                                             parcelas INTEGER, attempts INTEGER, wait REAL, elapsed REAL,
+                                             ocr_time REAL, network_time REAL, error TEXT, finished_at REAL);
+            CREATE TABLE IF NOT EXISTS parcels (documento TEXT NOT NULL, parcela TEXT NOT NULL, data TEXT NOT NULL,
+                                                PRIMARY KEY (documento, parcela));
+        """)
+
+    def close(self) -> None:
+        self.__con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __log(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
+    def __save(self, documento, status, table=None, error=None, **timings):
+
+        with self.__lock, self.__con:
+            self.__con.execute('DELETE FROM parcels WHERE documento = ?', (documento,))
+            if table is not None:
+                self.__con.executemany('INSERT INTO parcels VALUES (?, ?, ?)',
+                                       [(documento, i, json.dumps(row, ensure_ascii=False))
+                                        for i, row in zip(table.index, table.to_dict('records'))])
+            self.__con.execute('UPDATE jobs SET status = ?, parcelas = ?, attempts = ?, wait = ?, elapsed = ?, '
+                               'ocr_time = ?, network_time = ?, error = ?, finished_at = ? WHERE documento = ?',
+                               (status, 0 if table is None else len(table), timings.get('attempts'),
+                                timings.get('wait'), timings.get('elapsed'), timings.get('ocr_time'),
+                                timings.get('network_time'), error, time.time(), documento))
+
+    def __worker(self, jobs, started, total, done):
+
+        session, solver = new_session(), self.solver_factory()
+        while True:
+            try:
+                documento = jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            picked = time.monotonic()
+            query = sigef(documento, solver=solver, session=session, verbose=False, **self.options)
+            try:
+                table = query.consultar_sigef()
+                status, error = ('done' if table is not None else 'empty'), None
+            except Exception as e:
+                table, status, error = None, 'failed', f'{type(e).__name__}: {e}'
+
+            stats = query.statistics()
+            self.__save(documento, status, table, error, attempts=stats.get('attempts'),
+                        wait=picked - started, elapsed=time.monotonic() - picked,
+                        ocr_time=stats.get('ocr_time'), network_time=stats.get('network_time'))
+
+            with self.__lock:
+                done.append(status)
+                self.__log(f'[{len(done)}/{total}] {documento}: {status}', end='\r')
+
+        close = getattr(solver, 'close', None)
+        if close is not None:
+            close()
+
+    def run(self, documents: list, retry_failed: bool = True) -> dict:
+        """
+        Looks up every document that has no result in the store yet.
+
+        Parameters
+        ----------
+            documents : list
+                CPF/CNPJ numbers (formatted or not).
+            retry_failed : bool
+                Also runs the documents whose previous lookup failed.
+
+        Returns
+        -------
+        dict
+            The run report: lookups done, throughput (lookups/min), the time
+            each lookup waited for a worker and the time it took.
+        """
+        checked = check_documents(pd.Series(list(documents), dtype=object))
+        valid = checked['formatted_document'].dropna().drop_duplicates().tolist()
+        invalid = len(checked) - checked['formatted_document'].notna().sum()
+        if invalid:
+            self.__log(f'Warning: {invalid} entries are not a CPF/CNPJ and were skipped.')
+
+        with self.__lock, self.__con:
+            self.__con.executemany("INSERT OR IGNORE INTO jobs (documento, status) VALUES (?, 'pending')",
+                                   [(x,) for x in valid])
+            statuses = ('pending', 'failed') if retry_failed else ('pending',)
+            pending = set(x for x, in self.__con.execute(
+                f'SELECT documento FROM jobs WHERE status IN ({",".join("?" * len(statuses))})', statuses))
+
+        jobs = queue.Queue()
+        for documento in valid:
+            if documento in pending:
+                jobs.put(documento)
+
+        total, done = jobs.qsize(), []
+        self.__log(f'{len(valid) - total} documents already done, {total} to go.')
+        started = time.monotonic()
+
+        threads = [threading.Thread(target=self.__worker, args=(jobs, started, total, done), daemon=True)
+                   for _ in range(min(self.workers, total))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        elapsed = time.monotonic() - started
+        self.__log('')
+
+        run = self.jobs().query('documento in @pending')
+        report = {'lookups': total,
+                  'done': done.count('done'),
+                  'empty': done.count('empty'),
+                  'failed': done.count('failed'),
+                  'elapsed': elapsed,
+                  'throughput': 60 * total / elapsed if elapsed > 0 else None,
+                  'wait_mean': float(run['wait'].mean()),
+                  'wait_p95': float(run['wait'].quantile(0.95)),
+                  'lookup_mean': float(run['elapsed'].mean()),
+                  'lookup_p95': float(run['elapsed'].quantile(0.95)),
+                  'attempts_mean': float(run['attempts'].mean())}
+        self.__log(f"{report['done']} found, {report['empty']} without parcels, {report['failed']} failed; "
+                   f"{report['throughput'] or 0:.1f} lookups/min.")
+
+        return report
+
+    def jobs(self) -> pd.DataFrame:
+        with self.__lock:
+            return pd.read_sql('SELECT * FROM jobs', self.__con)
+
+    def results(self) -> pd.DataFrame:
+        with self.__lock:
+            rows = self.__con.execute('SELECT documento, parcela, data FROM parcels ORDER BY documento, parcela').fetchall()
+        out = pd.DataFrame([{'documento': d, 'parcela': p, **json.loads(x)} for d, p, x in rows])
+        return out if len(out) > 0 else pd.DataFrame(columns=['documento', 'parcela'])
@@ -0,0 +1,148 @@
+import pickle
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely import STRtree
+from embargos import ibama_geospatial, icmbio_geospatial, ldi_pa_geoespacial
+
+
+class EmbargoSpatialIndex:
+    """
+    A packed STRtree over the embargo polygons of IBAMA, ICMBio and LDI-PA.
+
+    The polygons are projected once to a metric CRS (SIRGAS 2000 / Brazil
+    Polyconic), so distances are given in meters and areas in hectares. The
+    index can be saved to disk and loaded back without downloading or
+    projecting the layers again.
+
+    Attributes
+    ----------
+    layer : gpd.GeoDataFrame
+        The embargo polygons (EPSG:4326) with a 'fonte' column.
+    geometries : np.ndarray
+        The polygons in the metric CRS, in the same order as layer.
+    tree : shapely.STRtree
+        The spatial index over geometries.
+
+    Methods
+    -------
+    from_sources(sources: list) -> EmbargoSpatialIndex:
+        Downloads the layers and builds the index.
+    load(path: str) -> EmbargoSpatialIndex:
+        Loads an index saved with save().
+    intersects(parcels) -> pd.DataFrame:
+        Returns the embargoes that intersect each parcel.
+    within_distance(parcels, distance: float) -> pd.DataFrame:
+        Returns the embargoes closer than distance (m) to each parcel.
+    overlap_area(parcels) -> pd.DataFrame:
+        Returns the area (ha) of each parcel covered by each embargo.
+    """
+
+    CRS = 'EPSG:4326'
+    METRIC_CRS = 'EPSG:5880'
+    COLUMNS = ['fonte', 'nome', 'documento', 'municipio', 'uf']
+
+    def __init__(self, layer: gpd.GeoDataFrame, geometries: np.ndarray = None) -> None:
+        self.layer = layer.to_crs(self.CRS).reset_index(drop=True)
+        if geometries is None:
+            geometries = shapely.make_valid(self.layer.geometry.to_crs(self.METRIC_CRS).to_numpy())
+        self.geometries = geometries
+        self.tree = STRtree(self.geometries)
+
+    @classmethod
+    def from_sources(cls, sources: tuple = ('ibama', 'icmbio', 'ldi_pa')) -> 'EmbargoSpatialIndex':
+        """
+        Downloads the embargo layers and builds the index.
+
+        Parameters
+        ----------
+            sources : tuple | list
+                Any of 'ibama', 'icmbio' and 'ldi_pa'.
+        """
+        loaders = {'ibama': ibama_geospatial,
+                   'icmbio': icmbio_geospatial,
+                   'ldi_pa': ldi_pa_geoespacial}
+
+        layers = []
+        for source in sources:
+            layer = loaders.get(source)()
+            if not isinstance(layer, gpd.GeoDataFrame):
+                raise ValueError(f"Unable to download the '{source}' layer.")
+            layer.insert(0, 'fonte', source)
+            layers.append(layer)
+
+        layer = gpd.GeoDataFrame(pd.concat(layers, ignore_index=True), geometry='geometry', crs=cls.CRS)
+        layer = layer.loc[layer.geometry.notna() & ~layer.geometry.is_empty]
+
+        return cls(layer)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            pickle.dump({'layer': self.layer, 'geometries': shapely.to_wkb(self.geometries)},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> 'EmbargoSpatialIndex':
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        return cls(data.get('layer'), shapely.from_wkb(data.get('geometries')))
+
+    def __len__(self) -> int:
+        return len(self.layer)
+
+    def __project(self, parcels) -> tuple:
+        if isinstance(parcels, gpd.GeoDataFrame):
+            parcels = parcels.geometry
+        if not isinstance(parcels, gpd.GeoSeries):
+            parcels = gpd.GeoSeries(parcels, crs=self.CRS)
+        if parcels.crs is None:
+            parcels = parcels.set_crs(self.CRS)
+        return parcels.index, shapely.make_valid(parcels.to_crs(self.METRIC_CRS).to_numpy())
+
+    def __pairs(self, labels, pairs) -> pd.DataFrame:
+        columns = [x for x in self.COLUMNS if x in self.layer.columns]
+        out = self.layer.iloc[pairs[1]][columns].reset_index(names='embargo')
+        out.insert(0, 'parcela', np.asarray(labels)[pairs[0]])
+        return out
+
+    def intersects(self, parcels) -> pd.DataFrame:
+        """
+        Returns one row per (parcel, embargo) pair that intersect.
+
+        Parameters
+        ----------
+            parcels : gpd.GeoDataFrame | gpd.GeoSeries | list
+                The parcel boundaries (EPSG:4326 when no CRS is set).
+
+        Returns
+        -------
+        pd.DataFrame
+            The parcel label, the position of the embargo in layer and its attributes.
+        """
+        labels, geoms = self.__project(parcels)
+        return self.__pairs(labels, self.tree.query(geoms, predicate='intersects'))
+
+    def within_distance(self, parcels, distance: float) -> pd.DataFrame:
+        """
+        Returns one row per (parcel, embargo) pair closer than distance, with the
+        distance in meters.
+        """
+        labels, geoms = self.__project(parcels)
+        pairs = self.tree.query(geoms, predicate='dwithin', distance=distance)
+        out = self.__pairs(labels, pairs)
+        out['distancia_m'] = shapely.distance(geoms[pairs[0]], self.geometries[pairs[1]])
+        return out
+
+    def overlap_area(self, parcels) -> pd.DataFrame:
+        """
+        Returns one row per (parcel, embargo) pair that overlap, with the
+        overlapping area in hectares and as a share of the parcel area.
+        """
+        labels, geoms = self.__project(parcels)
+        pairs = self.tree.query(geoms, predicate='intersects')
+        area = shapely.area(shapely.intersection(geoms[pairs[0]], self.geometries[pairs[1]]))
+        out = self.__pairs(labels, pairs)
+        out['area_ha'] = area / 1e4
+        out['fracao'] = area / shapely.area(geoms[pairs[0]])
+        return out.loc[out['area_ha'] > 0].reset_index(drop=True)
@@ -0,0 +1,123 @@
+import hashlib
+import shapely
+import pandas as pd
+import geopandas as gpd
+from sqlalchemy import MetaData, Table, Index, inspect, select, delete
+
+
+def content_hashes(gdf: gpd.GeoDataFrame, id_columns: list) -> pd.DataFrame:
+    """
+    Returns the row_id and row_hash of every row of a layer.
+
+    row_id identifies a feature by its id_columns and its geometry, so it is
+    stable across downloads; row_hash also covers every other attribute and
+    tells whether the feature has changed. Geometries are normalized first, so
+    the hash does not depend on the vertex order returned by the server.
+    Repeated features get an occurrence number appended to their row_id.
+
+    Parameters
+    ----------
+        gdf : gpd.GeoDataFrame
+            The layer.
+        id_columns : list
+            The attributes that identify a feature (e.g. ['documento']).
+
+    Returns
+    -------
+    pd.DataFrame
+        The row_id and row_hash columns, aligned with gdf.
+    """
+    wkb = shapely.to_wkb(shapely.normalize(gdf.geometry.values))
+    attributes = gdf.drop(columns=gdf.geometry.name).astype(str)
+    ids = attributes[list(id_columns)].agg('\x1f'.join, axis=1)
+    values = attributes.agg('\x1f'.join, axis=1)
+
+    row_id = pd.Series([hashlib.sha1(x.encode('utf-8') + g).hexdigest() for x, g in zip(ids, wkb)], index=gdf.index)
+    row_id = row_id + '-' + row_id.groupby(row_id).cumcount().astype(str)
+    row_hash = [hashlib.sha1(x.encode('utf-8') + g).hexdigest() for x, g in zip(values, wkb)]
+
+    return pd.DataFrame({'row_id': row_id, 'row_hash': row_hash}, index=gdf.index)
+
+
+def _append(gdf, name, con, schema):
+
+    if con.dialect.name == 'postgresql':
+        gdf.to_postgis(name=name, con=con, if_exists='append', schema=schema, index=False)
+    else:
+        # Other databases (e.g. SQLite/SpatiaLite) keep the geometry as WKB
+        df = pd.DataFrame(gdf)
+        df[gdf.geometry.name] = shapely.to_wkb(gdf.geometry.values)
+        df.to_sql(name=name, con=con, if_exists='append', index=False)
+
+
+def sync_layer(gdf: gpd.GeoDataFrame, name: str, engine, schema: str = 'public',
+               id_columns: tuple = ('documento',), chunk_size: int = 1000) -> dict:
+    """
+    Synchronizes a SQL table with a freshly downloaded layer, inserting,
+    updating and deleting only the rows that changed.
+
+    The table keeps a row_id and a row_hash column (see content_hashes). A
+    table without them, e.g. one written by to_postgis(if_exists='replace'), is
+    rebuilt once. Every change happens in a single transaction.
+
+    Parameters
+    ----------
+        gdf : gpd.GeoDataFrame
+            The current content of the layer.
+        name : str
+            The table name.
+        engine : sqlalchemy.engine.Engine
+            The database connection (PostGIS, or SQLite for tests).
+        schema : str
+            The schema of the table (PostgreSQL only).
+        id_columns : tuple
+            The attributes that identify a feature.
+        chunk_size : int
+            The number of ids per DELETE statement.
+
+    Returns
+    -------
+    dict
+        The number of rows inserted, updated, deleted and unchanged.
+    """
+    layer = pd.concat([gdf, content_hashes(gdf, id_columns)], axis=1)
+    report = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    with engine.begin() as con:
+        schema = schema if con.dialect.name == 'postgresql' else None
+        inspector = inspect(con)
+
+        columns = [x['name'] for x in inspector.get_columns(name, schema=schema)] if inspector.has_table(name, schema=schema) else []
+        if not {'row_id', 'row_hash'}.issubset(columns):
+            if len(columns) > 0:
+                Table(name, MetaData(), schema=schema, autoload_with=con).drop(con)
+            _append(layer, name, con, schema)
+            table = Table(name, MetaData(), schema=schema, autoload_with=con)
+            Index(name + '_row_id_idx', table.c.row_id).create(con)
+            report['inserted'] = len(layer)
+            return report
+
+        table = Table(name, MetaData(), schema=schema, autoload_with=con)
+        stored = pd.DataFrame(con.execute(select(table.c.row_id, table.c.row_hash)).fetchall(),
+                              columns=['row_id', 'row_hash'])
+
+        merged = layer[['row_id', 'row_hash']].merge(stored, on='row_id', how='outer',
+                                                      suffixes=('', '_stored'), indicator=True)
+        inserted = merged.loc[merged['_merge'] == 'left_only', 'row_id']
+        deleted = merged.loc[merged['_merge'] == 'right_only', 'row_id']
+        both = merged.loc[merged['_merge'] == 'both']
+        updated = both.loc[both['row_hash'] != both['row_hash_stored'], 'row_id']
+
+        # An update replaces the stored row
+        remove = pd.concat([deleted, updated]).to_list()
+        for i in range(0, len(remove), chunk_size):
+            con.execute(delete(table).where(table.c.row_id.in_(remove[i:i + chunk_size])))
+
+        write = layer.loc[layer['row_id'].isin(pd.concat([inserted, updated]))]
+        if len(write) > 0:
+            _append(write, name, con, schema)
+
+        report.update({'inserted': len(inserted), 'updated': len(updated),
+                       'deleted': len(deleted), 'unchanged': len(both) - len(updated)})
+
+    return report
@@ -1,51 +1,126 @@
+import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sessions import thread_sessions
+from units import UNITS, CROPS, BUSHEL_LBS, weight_factor
+
+
+BASE_URL = 'https://tradingeconomics.com'
+HEADERS = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
 
 
 class TEquotes:
     """
     Module for returning quotations for agricultural commodities on the
     Trading Economics platform.
+
+    Building the object makes no request. Each forecast page is downloaded
+    once and kept as a snapshot for ttl seconds, so any number of quotes
+    within that time costs one request per page; the unit of each crop is
+    looked up once and cached.
     """
 
-    def __init__(self):
-        self.crops = self.__list_crops()
-        self.currencies = self.__list_currencies()
+    def __init__(self, ttl: float = 300, session: requests.Session = None):
+        self.ttl = ttl
+        self.session = requests.Session() if session is None else session
+        self.session.headers.update(HEADERS)
         self.convweights = self.__list_conversion_weights()
+        self.__snapshots = {}
+        self.__units = {}
 
-    def __list_crops(self) -> list:
+
+    def __snapshot(self, path: str) -> dict:
         """
-        Returns a list with all possible quotes for agricultural crops.
+        Returns the parsed page at path, downloading it only when the cached
+        snapshot is older than ttl.
 
         Returns:
-        -------
-        ['Crop_1', 'Crop_2', ..., 'Crop_n']
+        --------
+        {'fetched_at': float, 'content': bytes, 'soup': BeautifulSoup, 'frames': dict} or None
         """
 
-        session = requests.Session()
+        snapshot = self.__snapshots.get(path)
+        if snapshot is not None and time.time() - snapshot.get('fetched_at') < self.ttl:
+            return snapshot
+
+        req = self.session.get(f'{BASE_URL}{path}')
+        if not req.ok:
+            print(f'Error: the server returned the {str(req.status_code)} code error.')
+            return None
+
+        snapshot = {'fetched_at': time.time(),
+                    'content': req.content,
+                    'soup': BeautifulSoup(req.content, 'html.parser'),
+                    'frames': {}}
+        self.__snapshots[path] = snapshot
 
-        url = 'https://tradingeconomics.com/forecast/commodity'
-        headers = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
+        return snapshot
 
-        req = session.get(url, headers=headers)
-        if req.ok:
-            soup = BeautifulSoup(req.content, 'html.parser')
-            items = [[y.text for y in x.select('b')] for x in soup.select('table')]
 
-            tables = [[y.text for y in x.select('th')][1].strip() for x in soup.select('table')]
-            idx = tables.index('Agricultural')
+    def __frame(self, snapshot: dict, name: str) -> pd.DataFrame:
+        """
+        Returns the quotes of one table of a snapshot (the table whose header
+        is name, e.g. 'Agricultural' or 'Major') in long format, parsing only
+        that table and only the first time.
 
-            crops = items[idx]
-        else:
-            print(f'Error: the server returned the {str(req.status_code)} code error.')
-            crops = None
+        Returns:
+        --------
+        pd.DataFrame with the instrument, horizon and price columns
+        """
+
+        frames = snapshot.setdefault('frames', {})
+        if name in frames:
+            return frames.get(name)
+
+        table = None
+        for x in snapshot.get('soup').select('table'):
+            heads = [y.text.strip() for y in x.select('th')]
+            if len(heads) > 1 and heads[1] == name:
+                table = x
+                break
+
+        rows = []
+        if table is not None:
+            # Price is the current quote; the other columns (but Signal) are forecast horizons
+            columns = [(i, 'today' if h == 'Price' else h) for i, h in enumerate(heads) if i > 1 and h != 'Signal']
+            for tr in table.select('tr'):
+                instrument, cells = tr.find('b'), tr.find_all('td')
+                if instrument is None or len(cells) < len(heads):
+                    continue
+                for i, horizon in columns:
+                    price = pd.to_numeric(cells[i].text.strip().replace(',', ''), errors='coerce')
+                    rows.append((instrument.text.strip(), horizon, price))
+
+        frames[name] = pd.DataFrame(rows, columns=['instrument', 'horizon', 'price'])
+        return frames.get(name)
+
+
+    @property
+    def crops(self) -> list:
+        """
+        Returns a list with all possible quotes for agricultural crops.
+
+        Returns:
+        -------
+        ['Crop_1', 'Crop_2', ..., 'Crop_n']
+        """
+
+        snapshot = self.__snapshot('/forecast/commodity')
+        if snapshot is None:
+            return None
 
-        return crops
+        soup = snapshot.get('soup')
+        items = [[y.text for y in x.select('b')] for x in soup.select('table')]
+        tables = [[y.text for y in x.select('th')][1].strip() for x in soup.select('table')]
 
+        return items[tables.index('Agricultural')]
 
-    def __list_currencies(self) -> dict:
+
+    @property
+    def currencies(self) -> dict:
         """
         Returns a dictionary with all currency conversion possibilities.
 
@@ -59,60 +134,70 @@ class TEquotes:
         ]
         """
 
-        session = requests.Session()
-
-        url = 'https://tradingeconomics.com/forecast/currency'
-        headers = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
+        snapshot = self.__snapshot('/forecast/currency')
+        if snapshot is None:
+            return None
 
-        req = session.get(url, headers=headers)
-        if req.ok:
-            soup = BeautifulSoup(req.content, 'html.parser')
-            items = [[{'from': y.text[:3], 'to': y.text[3:]} for y in x.select('b')] for x in soup.select('table')]
-            areas = [[y.text for y in x.select('th')][1].strip() for x in soup.select('table')]
-            currencies = {a: c for a, c in zip(areas, items)}
-        else:
-            print(f'Error: the server returned the {str(req.status_code)} code error.')
-            currencies = None
+        soup = snapshot.get('soup')
+        items = [[{'from': y.text[:3], 'to': y.text[3:]} for y in x.select('b')] for x in soup.select('table')]
+        areas = [[y.text for y in x.select('th')][1].strip() for x in soup.select('table')]
 
-        return currencies
+        return {a: c for a, c in zip(areas, items)}
 
 
     def __list_conversion_weights(self):
 
-        return {'Soybeans': ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU'],
-                'Wheat':    ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU'],
-                'Corn':     ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU'],
-                'Sorghum':  ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU'],
-                'Barley':   ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU'],
-                'Oat':      ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU'],
-                'Default':  ['Lbs', 'CWT', 'kg', 't', 'bag60']}
+        return {crop: [x for x in UNITS if x != 'BU' or crop in BUSHEL_LBS] for crop in CROPS}
 
 
-    def __get_unit(self, url: str, name: str) -> 'tuple[str, str]':
+    def __get_unit(self, crop: str, session: requests.Session = None) -> str:
         """
-        Returns a tuple with the name of the agricultural crop and its respective unit.
+        Returns the quote unit of an agricultural crop, looking it up in the
+        crop page only the first time.
 
         Parameters:
         -----------
-        Parameter url: the URL to lookup the quote unit
-        Parameter name: the name of the crop
+        Parameter crop: the name of the crop
+        Parameter session: the session of the calling thread (self.session if None)
 
         Returns:
         --------
-        ('crop_name', 'unit')
+        'unit' (None when it cannot be found)
         """
 
-        with requests.Session() as session:
-            session.headers = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
-            req = session.get(url=url)
-            if req.ok:
-                soup = BeautifulSoup(req.content, 'html.parser')
-                table = soup.find_all('table')[1]
-                unit = [[(i.text).strip() for i in row.find_all('td')][1:] for row in table.find_all('tr')][1:][0][5]
-                return name, unit
-            else:
+        if crop in self.__units:
+            return self.__units.get(crop)
+
+        snapshot = self.__snapshot('/forecast/commodity')
+        if snapshot is None:
+            return None
+
+        # The link of the crop is the one whose <b> text is the crop name
+        # (e.g. 'Palm Oil' -> '/commodity/palm-oil')
+        link = None
+        for a in snapshot.get('soup').find_all('a', href=True):
+            name = (a.find('b') or a).get_text(strip=True)
+            if name.lower() == crop.lower() and '/commodity/' in a['href']:
+                link = a['href']
+                break
+        if link is None:
+            print(f"Warning: Unable to find the page of the '{crop}' crop; its unit is unknown.")
+            return None
+
+        try:
+            req = (self.session if session is None else session).get(f'{BASE_URL}{link}')
+            if not req.ok:
                 print(f'Error: the server returned the {str(req.status_code)} code error.')
                 return None
+            soup = BeautifulSoup(req.content, 'html.parser')
+            table = soup.find_all('table')[1]
+            unit = [[(i.text).strip() for i in row.find_all('td')][1:] for row in table.find_all('tr')][1:][0][5]
+        except (requests.RequestException, IndexError) as e:
+            print(f"Warning: Unable to read the unit of the '{crop}' crop ({type(e).__name__}).")
+            return None
+
+        self.__units[crop] = unit
+        return unit
 
 
     def crop_quote(self, crop: str) -> dict:
@@ -134,39 +219,59 @@ class TEquotes:
         ]
         """
 
-        if not crop.title() in self.crops:
+        crops = self.crops
+        if crops is None:
+            return None
+
+        if not crop.title() in crops:
             print(f"Warning: Unable to find the '{crop.lower()}' crop. See the crops list to find all the possibilities.")
             return None
 
-        session = requests.Session()
+        df = self.crop_quotes([crop])
+        if df is None:
+            return None
 
-        base = 'https://tradingeconomics.com'
-        url = f'{base}/forecast/commodity'
+        return [{'date': d, 'price': p, 'unit': u} for d, p, u in zip(df['horizon'], df['price'], df['unit'])]
 
-        headers = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
 
-        req = session.get(url, headers=headers)
+    def crop_quotes(self, crops: list = None, workers: int = 8) -> pd.DataFrame:
+        """
+        Returns the current and future quotations of many agricultural crops in
+        a single long-format table. Only the agricultural table of the page is
+        parsed, and the units not cached yet are looked up concurrently.
 
-        if req.ok:
-            df = pd.read_html(req.content)[2].drop(columns=['Unnamed: 0', 'Signal'])
-            df = df.loc[df['Agricultural'] == crop.title()].set_index('Agricultural')
-            df = df.T.reset_index()
-            df.columns = ['date', 'price']
-            df = df.replace({'Price': 'today'})
+        Parameters:
+        -----------
+        Parameter crops: the names of the crops (all of them if None)
+        Parameter workers: the number of unit pages fetched at the same time
 
-            soup = BeautifulSoup(req.content, 'html.parser')
+        Returns:
+        --------
+        pd.DataFrame with the instrument, horizon ('today', 'QX/XX', ...), price and unit columns
+        """
 
-            args = [[f"{base}{x['href']}", re.sub('\n', '', x.text)] for x in soup.find_all('a', href=True)]
-            args = list(filter(lambda x: f'/commodity/{crop.lower()}' in x[0], args))[0]
+        snapshot = self.__snapshot('/forecast/commodity')
+        if snapshot is None:
+            return None
 
-            units = self.__get_unit(*args)
+        df = self.__frame(snapshot, 'Agricultural')
+        if crops is not None:
+            crops = [x.title() for x in crops]
+            unknown = sorted(set(crops) - set(df['instrument']))
+            if unknown:
+                print(f"Warning: Unable to find the crop(s) {', '.join(unknown)}. See the crops list to find all the possibilities.")
+            df = df.loc[df['instrument'].isin(crops)]
 
-            out = [{'date': d, 'price': p, 'unit': units[1]} for d, p in zip(df['date'], df['price'])]
-        else:
-            print(f'Error: the server returned the {str(req.status_code)} code error.')
-            out = None
+        missing = [x for x in df['instrument'].unique() if x not in self.__units]
+        if missing:
+            # Each worker thread has its own copy of self.session
+            with thread_sessions(self.session) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda crop: self.__get_unit(crop, session()), missing))
 
-        return out
+        df = df.assign(unit=df['instrument'].map(self.__units)).reset_index(drop=True)
+        df.attrs['fetched_at'] = snapshot.get('fetched_at')
+
+        return df
 
 
     def currency_quote(self, input: str, output: str, area: str = 'Major') -> dict:
@@ -190,75 +295,74 @@ class TEquotes:
         ]
         """
 
-        base = 'https://tradingeconomics.com'
-        url = f'{base}/forecast/currency'
-        headers = {'user-agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
+        df = self.currency_quotes([(input, output)], area=area)
+        if df is None:
+            return None
 
-        session = requests.Session()
+        if len(df) == 0:
+            print(f'Warning: Unable to convert {input} to {output}. See currencies list to find all the possibilities.')
+            return None
 
-        req = session.get(url, headers=headers)
+        return [{'date': d, 'price': p, 'from': input, 'to': output} for d, p in zip(df['horizon'], df['price'])]
 
-        if req.ok:
-            soup = BeautifulSoup(req.content, 'html.parser')
-            a = [re.sub('\r\n\W+', '', x.text).strip() for x in soup.select('th')]
-            r = re.compile(r'/|Signal|Price|^$')
-            areas = list(filter(lambda x: not r.search(x), a))
-
-            idx = areas.index(area)
-
-            df = pd.read_html(req.content)[idx].drop(columns=['Unnamed: 0', 'Signal'])
-            df['input'] = df[area].str.slice(stop=3)
-            df['output'] = df[area].str.slice(start=3)
-            try:
-                df = df.loc[(df['input'] == input) & (df['output'] == output)]
-                df = df.drop(columns=['input', 'output', area])
-                df = df.T.reset_index()
-                df.columns = ['date', 'price']
-                df = df.replace({'Price': 'today'})
-                out = [{'date': d, 'price': p, 'from': input, 'to': output} for d, p in zip(df['date'], df['price'])]
-            except ValueError:
-                print(f'Warning: Unable to convert {input} to {output}. See currencies list to find all the possibilities.')
-                out = None
-        else:
-            print(f'Error: the server returned the {str(req.status_code)} code error.')
-            out = None
 
-        return out
+    def currency_quotes(self, pairs: list = None, area: str = None) -> pd.DataFrame:
+        """
+        Returns the current and future exchange rates of many currency pairs
+        in a single long-format table.
+
+        Parameters:
+        -----------
+        Parameter pairs: a list of (from, to) tuples, e.g. [('USD', 'BRL'), ('EUR', 'USD')] (all pairs if None)
+        Parameter area: looks for the pairs only in this area table (all areas if None)
+
+        Returns:
+        --------
+        pd.DataFrame with the instrument ('USDBRL'), horizon, price and unit ('BRL/USD') columns
+        """
+
+        snapshot = self.__snapshot('/forecast/currency')
+        if snapshot is None:
+            return None
+
+        areas = [area] if area is not None else list(self.currencies.keys())
+        df = pd.concat([self.__frame(snapshot, x) for x in areas], ignore_index=True)
+        df = df.drop_duplicates(subset=['instrument', 'horizon'])
+
+        if pairs is not None:
+            df = df.loc[df['instrument'].isin([f'{a}{b}' for a, b in pairs])]
 
+        df = df.assign(unit=df['instrument'].str.slice(start=3) + '/' + df['instrument'].str.slice(stop=3))
+        df = df.reset_index(drop=True)
+        df.attrs['fetched_at'] = snapshot.get('fetched_at')
 
-    def conversion_weights(self, crop: str = 'Default', input: str, output: str) -> float:
+        return df
+
+
+    def conversion_weights(self, input: str, output: str, crop: str = 'Default') -> float:
         """
         Returns a numeric conversion factor for converting the 'input' to 'output'
         weight unit. Some conversions need to provide the crop name for the correct
         weight unit conversion, such as those involving volumetric unit to mass
-        unit conversion.
+        unit conversion. The arguments can also be lists or Series (one
+        conversion per element), which are converted at once.
 
         Parameters:
         -----------
-        Parameter crop: the crop of unit to be converted
         Parameter input: the weight unit to be converted
         Parameter output: the desired weight unit
+        Parameter crop: the crop of unit to be converted
 
         Returns:
         --------
-        float
+        float (np.ndarray for list arguments, NaN where not convertible)
         """
 
-        data = {'Soybeans': {'Lbs': 60, 'CWT': 6000, 'kg': 27.216, 't': 0.027216, 'bag60': 0.45360, 'BU': 1},
-                'Wheat':    {'Lbs': 60, 'CWT': 6000, 'kg': 27.216, 't': 0.027216, 'bag60': 0.45360, 'BU': 1},
-                'Corn':     {'Lbs': 56, 'CWT': 5600, 'kg': 25.402, 't': 0.025402, 'bag60': 0.42334, 'BU': 1},
-                'Sorghum':  {'Lbs': 56, 'CWT': 5600, 'kg': 25.402, 't': 0.025402, 'bag60': 0.42334, 'BU': 1},
-                'Barley':   {'Lbs': 48, 'CWT': 4800, 'kg': 21.773, 't': 0.021773, 'bag60': 0.36288, 'BU': 1},
-                'Oat':      {'Lbs': 32, 'CWT': 3200, 'kg': 14.515, 't': 0.014515, 'bag60': 0.24192, 'BU': 1},
-                'Default':  {'Lbs':  1, 'CWT': 100,  'kg': 0.4536, 't': 0.004536, 'bag60': 0.00756}}
-
         try:
-            units = data.get(crop).keys()
-            if (input in units) & (output in units):
-                out = data.get(crop).get(output) / data.get(crop).get(input)
-            else:
-                out = None
-        except Exception:
+            out = weight_factor(input, output, crop)
+        except ValueError:
+            out = np.nan
+        if np.ndim(out) == 0 and np.isnan(out):
             print(f'Warning: Unable to convert {input} to {output}. See convweights list to find all the possibilities.')
             out = None
 
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+from io import StringIO
+from pandas.tests.extension import base
+from pandas.tests.extension.conftest import *  # noqa: F401,F403
+
+from document_array import DocumentArray, DocumentDtype
+
+
+A, B, C = '00000000191', '11144477735', '12345678000195'
+
+
+@pytest.fixture
+def dtype():
+    return DocumentDtype()
+
+
+@pytest.fixture
+def data():
+    values = np.random.default_rng(0).choice(10 ** 11, 10, replace=False)
+    return DocumentArray.from_documents([f'{x:011d}' for x in values])
+
+
+@pytest.fixture
+def data_missing():
+    return DocumentArray.from_documents([None, A])
+
+
+@pytest.fixture
+def data_for_sorting():
+    return DocumentArray.from_documents([B, C, A])
+
+
+@pytest.fixture
+def data_missing_for_sorting():
+    return DocumentArray.from_documents([B, None, A])
+
+
+@pytest.fixture
+def data_for_grouping():
+    return DocumentArray.from_documents([B, B, None, None, A, A, B, C])
+
+
+@pytest.fixture
+def na_cmp():
+    return lambda x, y: x is pd.NA and y is pd.NA
+
+
+# Fixtures of pandas' own conftest.py, which needs hypothesis
+
+@pytest.fixture(params=[None, lambda x: x])
+def sort_by_key(request):
+    return request.param
+
+
+@pytest.fixture(params=[True, False])
+def using_nan_is_na(request):
+    with pd.option_context('future.distinguish_nan_and_na', not request.param):
+        yield request.param
+
+
+class TestDocumentArray(base.BaseDtypeTests, base.BaseConstructorsTests, base.BaseGetitemTests,
+                        base.BaseSetitemTests, base.BaseMissingTests, base.BaseMethodsTests,
+                        base.BaseInterfaceTests, base.BaseReshapingTests, base.BaseCastingTests,
+                        base.BaseGroupbyTests, base.BasePrintingTests, base.BaseIndexTests,
+                        base.BaseParsingTests):
+    pass
+
+
+def test_fillna_where_and_read_csv():
+    s = pd.Series(DocumentArray.from_documents(['111.444.777-35', None, 'abc']))
+
+    filled = s.fillna('12.345.678/0001-95')
+    assert filled.tolist() == ['11144477735', '12345678000195', '12345678000195']
+    assert filled.doc.isvalid.tolist() == [True, True, True]
+
+    assert s.where(s.notna(), A).tolist() == ['11144477735', A, A]
+
+    df = pd.read_csv(StringIO('d\n00000000191\n12.345.678/0001-95\n\n'), dtype={'d': 'document'}, skip_blank_lines=False)
+    assert df['d'].dtype == DocumentDtype()
+    assert df['d'].tolist() == [A, C, pd.NA]
+
+    assert pd.Series([11144477735.0, np.nan]).astype('document').tolist() == [B, pd.NA]
+
+
+def test_setitem_resets_lazy_attributes():
+    arr = DocumentArray.from_documents([A, B])
+    assert arr.isvalid.tolist() == [True, True]
+
+    arr[0] = '00000000192'
+    assert arr.isvalid.tolist() == [False, True]
+    assert arr.formatted.tolist() == ['000.000.001-92', '111.444.777-35']
+
+    with pytest.raises(TypeError):
+        arr[1] = 1.5
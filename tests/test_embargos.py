@@ -0,0 +1,79 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import embargos
+
+
+# Documents ending in 1 are embargoed. 22222222222 fails once with a 503,
+# 33333333333 always fails and 44444444444 never answers in time.
+HITS = {}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _reply(self, doc, found, empty):
+        if doc:
+            HITS[doc] = HITS.get(doc, 0) + 1
+        if doc == '44444444444':
+            threading.Event().wait(1)
+            return
+        if doc == '33333333333' or (doc == '22222222222' and HITS[doc] == 1):
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(found if doc.endswith('1') or doc == '22222222222' else empty)
+
+    def do_GET(self):
+        doc = parse_qs(urlparse(self.path).query).get('cpfCnpj', [''])[0]
+        self._reply(doc, json.dumps([{'id': 1}]).encode(), b'[]')
+
+    def do_POST(self):
+        body = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        doc = body.get('cpf_cnpj', [''])[0]
+        self._reply(doc, b'<div>ok</div>', '<div id="erro">Não há resultados para essa consulta.</div>'.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{srv.server_port}'
+    srv.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(embargos.time, 'sleep', lambda seconds: None)
+    HITS.clear()
+
+
+@pytest.mark.parametrize('concurrency', [None, 4])
+@pytest.mark.parametrize('source', [embargos.ibama_doc, embargos.amazonia_protege_doc])
+def test_retries_and_failures(server, source, concurrency):
+    docs = ['123.456.789-01', '98765432100', '22222222222', '33333333333', '44444444444', 'abc', '12345678901']
+    out = source(docs, concurrency=concurrency, retries=2, timeout=0.5, url=server)
+
+    assert out == [True, False, True, None, None, None, True]
+    assert HITS['22222222222'] == 2
+    assert HITS['33333333333'] == 3
+    assert HITS['12345678901'] == 1
+    assert set(HITS) == {'12345678901', '98765432100', '22222222222', '33333333333', '44444444444'}
+
+
+def test_screen_documents(server):
+    urls = {'ibama': server, 'amazonia_protege': server}
+    out = embargos.screen_documents(['12345678901', None, '98765432100'], sources=['ibama', 'amazonia_protege'],
+                                    concurrency=2, retries=1, urls=urls)
+
+    assert out['documento'].tolist() == ['12345678901', None, '98765432100']
+    assert out['ibama'].tolist() == [True, None, False]
+    assert out['amazonia_protege'].tolist() == [True, None, False]
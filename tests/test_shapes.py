@@ -0,0 +1,54 @@
+from io import BytesIO
+
+import shapefile
+import shapely
+
+import embargos
+
+
+def square(x, y, size=1.0, clockwise=True):
+    ring = [(x, y), (x, y + size), (x + size, y + size), (x + size, y), (x, y)]
+    return ring if clockwise else ring[::-1]
+
+
+def read_shapes(records):
+    shp, shx, dbf = BytesIO(), BytesIO(), BytesIO()
+    with shapefile.Writer(shp=shp, shx=shx, dbf=dbf, shapeType=shapefile.POLYGON) as w:
+        w.field('id', 'N')
+        for i, rings in enumerate(records):
+            if rings:
+                w.poly(rings)
+            else:
+                w.null()
+            w.record(i)
+    return shapefile.Reader(shp=shp, shx=shx, dbf=dbf).shapes()
+
+
+def test_holes_multipart_and_winding():
+    records = [
+        # outer ring and its hole
+        [square(0, 0, 4), square(1, 1, 1, clockwise=False)],
+        # two outer rings; the hole of the first one comes after the second
+        [square(0, 0, 4), square(10, 0, 4), square(1, 1, 1, clockwise=False)],
+        # a single ring wound the wrong way
+        [square(0, 0, 2, clockwise=False)],
+        # two disjoint rings, the second one wound as a hole
+        [square(0, 0, 2), square(5, 5, 2, clockwise=False)],
+        # two outer rings wound the wrong way
+        [square(0, 0, 1, clockwise=False), square(5, 5, 1, clockwise=False)],
+        [],
+    ]
+    geoms = embargos._polygons_from_shapes(read_shapes(records))
+
+    assert geoms[0].geom_type == 'Polygon' and len(geoms[0].interiors) == 1 and geoms[0].area == 15
+
+    assert geoms[1].geom_type == 'MultiPolygon' and geoms[1].area == 31
+    first, second = sorted(geoms[1].geoms, key=lambda g: g.bounds)
+    assert len(first.interiors) == 1 and len(second.interiors) == 0
+
+    assert geoms[2].geom_type == 'Polygon' and geoms[2].area == 4
+    assert geoms[3].geom_type == 'MultiPolygon' and geoms[3].area == 8
+    assert geoms[4].geom_type == 'MultiPolygon' and geoms[4].area == 2
+    assert geoms[5] is None
+
+    assert shapely.is_valid(geoms[:5]).all()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+
+LB = 0.45359237
+
+# The weight units and the crops with a bushel weight (lbs per bushel)
+UNITS = ['Lbs', 'CWT', 'kg', 't', 'bag60', 'BU']
+BUSHEL_LBS = {'Soybeans': 60, 'Wheat': 60, 'Corn': 56, 'Sorghum': 56, 'Barley': 48, 'Oat': 32}
+CROPS = list(BUSHEL_LBS) + ['Default']
+
+ALIASES = {'soybean': 'Soybeans', 'soy': 'Soybeans', 'oats': 'Oat', 'bu': 'BU', 'bushel': 'BU',
+           'lb': 'Lbs', 'ton': 't', 'sc': 'bag60', 'bag': 'bag60'}
+
+
+def _kilograms():
+
+    # kg in one unit of each crop; the bushel is a volume, so Default has none
+    kg = np.empty((len(CROPS), len(UNITS)))
+    for i, crop in enumerate(CROPS):
+        kg[i] = [LB, 100 * LB, 1, 1000, 60, BUSHEL_LBS.get(crop, np.nan) * LB]
+    return kg
+
+
+KILOGRAMS = _kilograms()
+
+# FACTORS[crop, input, output]: how many output units weigh one input unit
+FACTORS = KILOGRAMS[:, :, None] / KILOGRAMS[:, None, :]
+
+_crop_index = pd.Index([x.lower() for x in CROPS])
+_unit_index = pd.Index([x.lower() for x in UNITS])
+
+
+def _lookup(index, names, name):
+
+    keys = pd.Series(np.atleast_1d(np.asarray(names, dtype=object))).astype(str).str.strip().str.lower()
+    keys = keys.replace({k: v.lower() for k, v in ALIASES.items()})
+    out = index.get_indexer(keys)
+    if (out < 0).any():
+        unknown = sorted(set(keys[out < 0]))
+        raise ValueError(f'Unknown {name}: {", ".join(unknown)}. Try one of {", ".join(CROPS if name == "crop" else UNITS)}.')
+    return out
+
+
+def weight_factor(input, output, crop='Default'):
+    """
+    Returns the factor that converts an amount in the input weight unit to the
+    output unit (e.g. weight_factor('BU', 'kg', 'Soybeans') = 27.2155...).
+    Conversions from or to bushels (BU) need the crop; the other ones are the
+    same for every crop.
+
+    Parameters
+    ----------
+        input, output : str | array-like
+            The weight units: 'Lbs', 'CWT' (100 lbs), 'kg', 't', 'bag60' or 'BU'.
+        crop : str | array-like
+            The crop, as in Trading Economics ('Soybeans', 'Corn', 'Oat'...).
+
+    Returns
+    -------
+    float | np.ndarray
+        A float for scalar arguments, otherwise an array with the broadcast
+        shape of the arguments (NaN where the crop has no bushel weight).
+    """
+    scalar = all(np.ndim(x) == 0 for x in (input, output, crop))
+    i, o, c = np.broadcast_arrays(_lookup(_unit_index, input, 'unit'),
+                                  _lookup(_unit_index, output, 'unit'),
+                                  _lookup(_crop_index, crop, 'crop'))
+    out = FACTORS[c, i, o]
+    return float(out[0]) if scalar else out
+
+
+def convert_weight(values, input, output, crop='Default'):
+    """
+    Converts amounts (a number, Series, DataFrame or array) from the input to
+    the output weight unit in one vectorized operation. The units and crops can
+    be scalars or one value per row.
+    """
+    return _apply(values, weight_factor(input, output, crop))
+
+
+def convert_price(prices, input, output, crop='Default', fx=1.0):
+    """
+    Converts prices per input weight unit to prices per output unit and,
+    optionally, to another currency, in one vectorized operation.
+
+    For example, the CBOT corn futures (US cents per bushel) in R$ per 60 kg
+    bag, given the BRL per USD rate of each contract:
+
+        convert_price(cents, 'BU', 'bag60', 'Corn', fx=brl_per_usd / 100)
+
+    Parameters
+    ----------
+        prices : float | array-like | pd.Series | pd.DataFrame
+            The prices. A DataFrame is converted row by row when the units,
+            crops or rates vary per row.
+        input, output : str | array-like
+            The weight units of the prices and of the result.
+        crop : str | array-like
+            The crop (needed for conversions involving bushels).
+        fx : float | array-like
+            The amount of the output currency per unit of the input currency.
+
+    Returns
+    -------
+        The converted prices, with the same type and index as prices.
+    """
+    # A price per input unit costs 1 / factor per output unit
+    factor = 1 / np.asarray(weight_factor(input, output, crop)) * np.asarray(fx, dtype=float)
+    return _apply(prices, factor)
+
+
+def _apply(values, factor):
+
+    factor = np.asarray(factor, dtype=float)
+    if factor.ndim == 0 or factor.size == 1:
+        return values * float(factor.reshape(-1)[0])
+    if isinstance(values, pd.DataFrame):
+        return values.mul(factor, axis=0)
+    if isinstance(values, pd.Series):
+        return values * factor
+    return np.asarray(values, dtype=float) * factor
@@ -0,0 +1,110 @@
+import re
+import json
+import requests
+import geopandas as gpd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sessions import thread_sessions
+
+
+def geojson_page(content: bytes, crs: str = 'EPSG:4326') -> gpd.GeoDataFrame:
+    """Parses a GeoJSON GetFeature response."""
+    data = json.loads(content)
+    return gpd.GeoDataFrame.from_features(data.get('features', []), crs=crs)
+
+
+def wfs_hits(url: str, typename: str, session: requests.Session = None, **params) -> int:
+    """
+    Returns the number of features of a WFS 2.0 layer (resultType=hits), or
+    None when the server does not report it.
+    """
+    s = requests.Session() if session is None else session
+
+    payload = {'service': 'WFS',
+               'version': '2.0.0',
+               'request': 'GetFeature',
+               'typeNames': typename,
+               'resultType': 'hits'}
+    payload.update(params)
+
+    req = s.get(url, params=payload)
+    req.raise_for_status()
+    matched = re.search(r'numberMatched="(\d+)"', req.text)
+
+    return int(matched.group(1)) if matched else None
+
+
+def wfs_pages(url: str, typename: str, page_size: int = 10000, workers: int = 4,
+              session: requests.Session = None, parse=geojson_page,
+              output_format: str = 'application/json', **params):
+    """
+    Pages through a WFS 2.0 layer with startIndex/count and yields one parsed
+    page at a time, in order.
+
+    Up to workers pages are downloaded and parsed in parallel, and no more than
+    workers pages are held in memory, so the peak memory does not depend on
+    the size of the layer. When the server does not report the number of
+    features, pages are fetched one at a time until a short page comes back.
+
+    Parameters
+    ----------
+        url : str
+            The WFS endpoint.
+        typename : str
+            The layer name.
+        page_size : int
+            The number of features per page (count).
+        workers : int
+            The number of pages fetched in parallel.
+        session : requests.Session
+            The session whose settings (headers, cookies, verify...) are used;
+            every thread that fetches pages has its own copy.
+        parse : callable
+            Converts the content of a page into a GeoDataFrame.
+        output_format : str
+            The outputFormat requested from the server.
+        **params
+            Extra parameters of the GetFeature request.
+
+    Yields
+    ------
+    gpd.GeoDataFrame
+        The features of each page.
+    """
+    # s() returns the session of the calling thread
+    with thread_sessions(session) as s:
+
+        def fetch(start):
+            payload = {'service': 'WFS',
+                       'version': '2.0.0',
+                       'request': 'GetFeature',
+                       'typeNames': typename,
+                       'outputFormat': output_format,
+                       'startIndex': start,
+                       'count': page_size}
+            payload.update(params)
+            req = s().get(url, params=payload)
+            req.raise_for_status()
+            return parse(req.content)
+
+        total = wfs_hits(url, typename, session=s(), **params)
+
+        if total is None:
+            start = 0
+            while True:
+                page = fetch(start)
+                if len(page) > 0:
+                    yield page
+                if len(page) < page_size:
+                    return
+                start += page_size
+
+        starts = iter(range(0, total, page_size))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque(executor.submit(fetch, x) for _, x in zip(range(workers), starts))
+            while pending:
+                page = pending.popleft().result()
+                start = next(starts, None)
+                if start is not None:
+                    pending.append(executor.submit(fetch, start))
+                yield page